@@ -1,4 +1,4 @@
 
-from .pptx_downsizer import downsize_pptx_images
+from .pptx_downsizer import downsize_pptx_images, downsize_pptx_bytes
 
 version = '0.1.3'
@@ -0,0 +1,92 @@
+"""
+
+Asyncio front-end for pptx-downsizer.
+
+`downsize_pptx_images` is blocking, so it is run in a thread, while the images are converted by
+a (possibly shared) CPU executor. The event loop is never blocked, and cancelling the task stops
+the remaining image conversions of the presentation.
+
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Executor
+from functools import partial
+
+from pptx_downsizer.pptx_downsizer import downsize_pptx_images
+from pptx_downsizer.utils import make_executor
+
+
+async def downsize_pptx_async(filename, executor='process', **kwargs):
+    """Downsize a pptx presentation without blocking the event loop.
+
+    If the task is cancelled, the image conversions that have not started yet are cancelled,
+    and we wait for the presentation to stop being processed before the cancellation is propagated.
+
+    Args:
+        filename: Filename (or binary file object) of the pptx file.
+        executor: The executor used to convert images, see `downsize_pptx_images`.
+            Use an existing `concurrent.futures.Executor` to share workers between presentations.
+        **kwargs: Other keyword arguments for `downsize_pptx_images`.
+            `overwrite` defaults to True, since we cannot prompt the user.
+
+    Returns:
+        The output of `downsize_pptx_images`, i.e. the filename of the downsized pptx file.
+
+    """
+    kwargs.setdefault('overwrite', True)
+    cancel_event = threading.Event()
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(None, partial(
+        downsize_pptx_images, filename, executor=executor, cancel_event=cancel_event, **kwargs))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancel_event.set()
+        try:
+            await future
+        except Exception:
+            pass  # Usually DownsizeCancelled, but the presentation may also have failed or finished.
+        raise
+
+
+async def downsize_pptx_batch(filenames, max_concurrent=4, jobs=None, executor='process', **kwargs):
+    """Downsize many presentations concurrently, yielding the results as they complete.
+
+    All presentations share one image conversion executor, and at most `max_concurrent` presentations
+    are processed at a time (so large batches do not read all presentations into memory at once).
+    If the consumer stops iterating (or is cancelled), all remaining presentations are cancelled.
+
+    Args:
+        filenames: The pptx files to downsize.
+        max_concurrent: The maximum number of presentations processed at the same time.
+        jobs: Number of image conversion workers, shared by all presentations (default: one per CPU).
+        executor: The kind of executor, 'process', 'thread', or 'serial', or an existing executor.
+        **kwargs: Other keyword arguments for `downsize_pptx_images`.
+
+    Yields:
+        (filename, result) tuples, in order of completion. The result is the output filename,
+        or the exception raised if the presentation could not be downsized.
+
+    """
+    semaphore = asyncio.Semaphore(max_concurrent)
+    pool = executor if isinstance(executor, Executor) else make_executor(executor, jobs=jobs)
+
+    async def run(filename):
+        async with semaphore:
+            try:
+                return filename, await downsize_pptx_async(filename, executor=pool, **kwargs)
+            except Exception as e:
+                return filename, e
+
+    tasks = [asyncio.ensure_future(run(filename)) for filename in filenames]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if pool is not executor:
+            # Shutting down waits for running conversions to finish, so do it in a thread, not on the event loop:
+            await asyncio.get_running_loop().run_in_executor(None, pool.shutdown)
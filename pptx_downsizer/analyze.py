@@ -0,0 +1,258 @@
+"""
+
+Dry-run analysis of pptx presentations: Is a presentation worth downsizing, and how much would it save?
+
+The analysis only reads the zip archive's central directory, the image headers, and the slides
+(to find how large the images are displayed). The converted size of each image is estimated by
+encoding a small, downscaled sample of the image. JPEG images are decoded directly at (about) the sample size,
+but other images must be decoded in full, so estimating takes about 0.1-0.2 seconds per large PNG or TIFF image
+(per CPU); with `estimate=False`, the analysis takes well under a second even for very large presentations.
+Nothing is extracted or written to disk.
+
+"""
+
+import argparse
+import inspect
+import json
+import os
+import posixpath
+import time
+import zipfile
+
+from PIL import Image
+
+from pptx_downsizer.images import estimate_image, fit_size, probe_image, AUTO_FORMATS, IMAGE_ERRORS
+from pptx_downsizer.pptx_downsizer import downsize_pptx_images, select_images, stream_name, JPEG_EXTENSIONS
+from pptx_downsizer.utils import convert_str_to_int, get_executor
+
+
+# Images are downscaled to (at most) this size (width or height) before estimating their converted size:
+SAMPLE_SIZE = 512
+
+DEFAULTS = {name: param.default for name, param in inspect.signature(downsize_pptx_images).parameters.items()}
+
+
+def estimate_converted_size(data, output_format, output_size, quality=90, optimize=False, quantize_colors=256,
+                            auto_formats=('png', 'png8', 'jpeg'), min_psnr=38.0, img_mode=None, crop=None,
+                            sample_size=SAMPLE_SIZE):
+    """Estimate the converted size of an image, by encoding a downscaled sample of the image.
+
+    Args:
+        data: The raw image file data (bytes).
+        output_format: The PIL image format to convert to, or 'auto'.
+        output_size: The (width, height) of the converted image.
+        quality, optimize, quantize_colors, auto_formats, min_psnr, img_mode, crop: Conversion parameters,
+            see `estimate_image` and `prepare_image`.
+        sample_size: Downscale the image to this size (width or height) before encoding it.
+            JPEG images are decoded directly at (about) this size, which is much faster than decoding the full image.
+
+    Returns:
+        (estimated size in bytes, candidate format used with 'auto', or None) tuple.
+
+    """
+    estimate = estimate_image(
+        data, output_format, [quality], optimize=optimize, quantize_colors=quantize_colors,
+        auto_formats=auto_formats, min_psnr=min_psnr, img_max_size=min(sample_size, max(output_size)), resample='box',
+        img_mode=img_mode, crop=crop)
+    sample_w, sample_h = estimate['size']
+    # Downscaled images have more detail per pixel, so this slightly over-estimates the size (i.e. is conservative):
+    return int(estimate['sizes'][quality] * output_size[0]*output_size[1] / (sample_w*sample_h)), estimate['candidate']
+
+
+def analyze_pptx(
+        filename, convert_to=DEFAULTS['convert_to'], fname_filter=DEFAULTS['fname_filter'],
+        fsize_filter=DEFAULTS['fsize_filter'], min_megapixels=DEFAULTS['min_megapixels'],
+        min_bpp=DEFAULTS['min_bpp'], img_max_size=DEFAULTS['img_max_size'], target_dpi=DEFAULTS['target_dpi'],
+        crop_images=DEFAULTS['crop_images'], dedupe_media=DEFAULTS['dedupe_media'], quality=DEFAULTS['quality'],
+        optimize=False, quantize_colors=DEFAULTS['quantize_colors'], auto_formats=DEFAULTS['auto_formats'],
+        min_psnr=DEFAULTS['min_psnr'], estimate=True, sample_size=SAMPLE_SIZE, jobs=None):
+    """Analyze a presentation, estimating how much each image could be reduced, without converting anything.
+
+    Images are selected, cropped and sized exactly as `downsize_pptx_images` would (see `select_images`),
+    and only the selected images are estimated.
+
+    Args:
+        filename: Filename of the pptx file (or a seekable binary file object).
+        convert_to, fname_filter, fsize_filter, min_megapixels, min_bpp, img_max_size, target_dpi, crop_images,
+        dedupe_media, quality, optimize, quantize_colors, auto_formats, min_psnr:
+            The conversion parameters to estimate the savings for, see `downsize_pptx_images`.
+            Samples are encoded without `optimize` by default, which is faster, but over-estimates PNG sizes slightly.
+        estimate: If False, only read the image headers, without estimating the converted sizes.
+        sample_size: Downscale images to this size before estimating their converted size.
+        jobs: Number of images to estimate in parallel (in threads). Default is to use one thread per CPU.
+
+    Returns:
+        dict with the pptx `size`, all `parts` (with their `size` and `compressed_size`),
+        the `images` (with format, dimensions, whether they are `selected` for conversion or `removed` as duplicates,
+        the `render_size`, `crop` and `output_size` in pixels, and the `estimated_size`), the `estimated_savings` in bytes,
+        and the `elapsed` time in seconds.
+
+    """
+    start = time.perf_counter()
+    convert_to = convert_to.lower().strip(".").replace("jpg", "jpeg")
+    if isinstance(auto_formats, str):
+        auto_formats = tuple(fmt.strip().lower() for fmt in auto_formats.split(","))
+    if isinstance(fsize_filter, str):
+        fsize_filter = convert_str_to_int(fsize_filter)
+    size = os.path.getsize(filename) if isinstance(filename, str) else filename.seek(0, os.SEEK_END)
+    with zipfile.ZipFile(filename) as zipfd:
+        members = zipfd.infolist()
+        parts = [{'name': zinfo.filename, 'size': zinfo.file_size, 'compressed_size': zinfo.compress_size}
+                 for zinfo in members]
+        selection = select_images(
+            zipfd, members, fname_filter=fname_filter, fsize_filter=fsize_filter, img_max_size=img_max_size,
+            min_megapixels=min_megapixels, min_bpp=min_bpp, target_dpi=target_dpi, crop_images=crop_images,
+            dedupe_media=dedupe_media, verbose=0)
+        probes, duplicates = selection['probes'], selection['duplicates']
+        selected = {zinfo.filename for zinfo in selection['selected']}
+        images = []
+        for zinfo in members:
+            probe = probes.get(zinfo.filename)
+            if probe is None:
+                continue
+            render_size = selection['render_sizes'].get(zinfo.filename)
+            crop = selection['crop_rects'].get(zinfo.filename)
+            region_size = (probe['width'], probe['height'])
+            if crop:
+                left, top, right, bottom = crop
+                region_size = (region_size[0] - round(left*region_size[0]) - round(right*region_size[0]),
+                               region_size[1] - round(top*region_size[1]) - round(bottom*region_size[1]))
+            image = dict(
+                name=zinfo.filename, format=probe['format'], mode=probe['mode'],
+                width=probe['width'], height=probe['height'], bpp=round(probe['bpp'], 2),
+                size=zinfo.file_size, compressed_size=zinfo.compress_size,
+                selected=zinfo.filename in selected, duplicate_of=duplicates.get(zinfo.filename),
+                removed=bool(dedupe_media and zinfo.filename in duplicates),
+                render_size=list(render_size) if render_size else None, crop=list(crop) if crop else None,
+                output_size=list(fit_size(region_size, img_max_size, 'box', render_size)),
+                estimated_size=None, estimated_format=None)
+            if posixpath.splitext(zinfo.filename)[1] in JPEG_EXTENSIONS:
+                image['output_format'] = 'JPEG'  # JPEG images are kept as JPEG.
+            elif convert_to == 'auto':
+                image['output_format'] = 'auto'
+            else:
+                image['output_format'] = Image.registered_extensions()["." + convert_to]
+            images.append(image)
+        if estimate:
+            # Identical images are converted together (with the same crop and output size), and estimated once:
+            futures = {}
+            with get_executor('thread', jobs=jobs) as pool:
+                for image in images:
+                    origfn = duplicates.get(image['name'], image['name'])
+                    if image['selected'] and origfn not in futures:
+                        futures[origfn] = pool.submit(
+                            estimate_converted_size, zipfd.read(origfn), image['output_format'],
+                            image['output_size'], quality=quality, optimize=optimize, quantize_colors=quantize_colors,
+                            auto_formats=auto_formats, min_psnr=min_psnr,
+                            img_mode='RGB' if image['output_format'] == 'JPEG' else None,
+                            crop=selection['crop_rects'].get(origfn), sample_size=sample_size)
+                for image in images:
+                    if not image['selected']:
+                        continue  # Not converted, e.g. small images, or animations.
+                    try:
+                        future = futures[duplicates.get(image['name'], image['name'])]
+                        image['estimated_size'], candidate = future.result()
+                    except IMAGE_ERRORS:
+                        continue  # E.g. truncated image data.
+                    image['estimated_format'] = AUTO_FORMATS[candidate][0] if candidate else image['output_format']
+    # Images are only worth converting if they get smaller, and removed duplicates save all of their size:
+    savings = sum(max(image['compressed_size'] - image['estimated_size'], 0)
+                  for image in images if image['estimated_size'] is not None)
+    savings += sum(image['compressed_size'] for image in images if image['removed'])
+    return {
+        'filename': filename if isinstance(filename, str) else stream_name(filename),
+        'size': size,
+        'parts': parts,
+        'images': images,
+        'estimated_savings': savings if estimate else None,
+        'elapsed': round(time.perf_counter() - start, 3),
+    }
+
+
+def print_analysis(analysis, max_parts=10):
+    """Print a human-readable summary of the analysis returned by `analyze_pptx`."""
+    images = sorted(analysis['images'], key=lambda image: image['compressed_size'], reverse=True)
+    image_names = {image['name'] for image in images}
+    print("\nAnalysis of %r (%0.01f MB, %s parts, %s images):\n" % (
+        analysis['filename'], analysis['size']/2**20, len(analysis['parts']), len(images)))
+    print("%-32s %-6s %11s %6s %11s %11s %9s" % (
+        "Image", "Format", "Dimensions", "bpp", "Output size", "Stored (kb)", "Est. (kb)"))
+    for image in images:
+        if image['removed']:
+            estimated = "removed"  # Duplicate.
+        elif not image['selected']:
+            estimated = "kept"  # Not converted.
+        else:
+            estimated = "-" if image['estimated_size'] is None else image['estimated_size']//1024
+        print("%-32s %-6s %11s %6.2f %11s %11s %9s" % (
+            posixpath.basename(image['name']), image['format'], "%sx%s" % (image['width'], image['height']),
+            image['bpp'], "%sx%s" % tuple(image['output_size']) if image['selected'] else "-",
+            image['compressed_size']//1024, estimated))
+    other_parts = sorted((part for part in analysis['parts'] if part['name'] not in image_names),
+                         key=lambda part: part['compressed_size'], reverse=True)
+    print("\nLargest other parts:")
+    for part in other_parts[:max_parts]:
+        print("  %-60s %9s kb" % (part['name'], part['compressed_size']//1024))
+    images_size = sum(image['compressed_size'] for image in images)
+    print("\nImages: %0.01f MB of %0.01f MB (%0.0f %%)." % (
+        images_size/2**20, analysis['size']/2**20, 100*images_size/max(analysis['size'], 1)))
+    if analysis['estimated_savings'] is not None:
+        print("Estimated size after downsizing: %0.01f MB (saving %0.01f MB, %0.0f %%)." % (
+            (analysis['size'] - analysis['estimated_savings'])/2**20, analysis['estimated_savings']/2**20,
+            100*analysis['estimated_savings']/max(analysis['size'], 1)))
+    print("(Analyzed in %0.02f s.)" % (analysis['elapsed'],))
+
+
+def get_argparser():
+    ap = argparse.ArgumentParser(
+        prog="pptx-downsizer analyze",
+        description=(
+            "Analyze PowerPoint presentations without changing them: list the images, "
+            "and estimate how much smaller the presentation would be after downsizing."),
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    ap.add_argument("filename", nargs="+", help="Path to the PowerPoint pptx file(s) to analyze.")
+    ap.add_argument("--fname-filter", metavar="GLOB", default=DEFAULTS['fname_filter'], help=(
+        "Only convert images matching this filename pattern, e.g. '*.TIFF'"))
+    ap.add_argument("--fsize-filter", metavar="SIZE", default=DEFAULTS['fsize_filter'], help=(
+        "Convert all images with a current file size exceeding this limit, e.g. '1e6' or '1mb'."))
+    ap.add_argument("--min-megapixels", metavar="MEGAPIXELS", default=DEFAULTS['min_megapixels'], type=float, help=(
+        "Also convert all images with more than this many megapixels."))
+    ap.add_argument("--min-bpp", metavar="BITS", default=DEFAULTS['min_bpp'], type=float, help=(
+        "Skip images that are stored using fewer bits per pixel than this."))
+    ap.add_argument("--crop-images", default=DEFAULTS['crop_images'], action="store_true", help=(
+        "Estimate the savings for removing the cropped-out regions of images."))
+    ap.add_argument("--dedupe-media", default=DEFAULTS['dedupe_media'], action="store_true", help=(
+        "Estimate the savings for storing identical images only once."))
+    ap.add_argument("--convert-to", metavar="IMAGE_FORMAT", default=DEFAULTS['convert_to'], help=(
+        "Estimate the savings for converting images to this format, e.g. `png`, `jpeg`, or `auto`."))
+    ap.add_argument("--auto-formats", metavar="FORMATS", default=",".join(DEFAULTS['auto_formats']), help=(
+        "Comma-separated list of the formats tried with `--convert-to auto`."))
+    ap.add_argument("--img-max-size", metavar="PIXELS", default=DEFAULTS['img_max_size'], type=int, help=(
+        "Estimate the savings for downscaling images to this size."))
+    ap.add_argument("--target-dpi", metavar="DPI", default=DEFAULTS['target_dpi'], type=float, help=(
+        "Estimate the savings for downscaling images to the size they are displayed at, at this resolution."))
+    ap.add_argument("--quality", metavar="[1-100]", default=DEFAULTS['quality'], type=int, help=(
+        "Quality of converted images (only applies to jpeg output)."))
+    ap.add_argument("--no-estimate", default=True, action="store_false", dest="estimate", help=(
+        "Only read the image headers, without estimating the converted image sizes (fastest)."))
+    ap.add_argument("--sample-size", metavar="PIXELS", default=SAMPLE_SIZE, type=int, help=(
+        "Downscale images to this size before estimating their converted size. "
+        "Larger samples give more accurate estimates, but take longer."))
+    ap.add_argument("--jobs", metavar="N", type=int, help=(
+        "Number of images to estimate in parallel. Default is to use one thread per CPU."))
+    ap.add_argument("--json", action="store_true", help=(
+        "Print the analysis as JSON (one object per presentation, one per line)."))
+    return ap
+
+
+def cli(argv=None):
+    argns = get_argparser().parse_args(argv)
+    params = vars(argns)
+    filenames, as_json = params.pop('filename'), params.pop('json')
+    for filename in filenames:
+        analysis = analyze_pptx(filename, **params)
+        if as_json:
+            print(json.dumps(analysis))
+        else:
+            print_analysis(analysis)
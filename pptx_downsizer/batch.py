@@ -0,0 +1,164 @@
+"""
+
+Batch mode for pptx-downsizer: Downsize many presentations, given as files, directories, and glob patterns.
+
+Several presentations are processed at the same time, and the images of all of them are converted by one shared
+worker pool. This keeps all workers busy, e.g. while one presentation waits for a single huge image to be
+converted, the workers can convert the many small images of the other presentations.
+
+"""
+
+import glob
+import inspect
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from pptx_downsizer.pptx_downsizer import downsize_pptx_images
+from pptx_downsizer.utils import get_executor
+
+
+# Default number of presentations processed at the same time:
+MAX_CONCURRENT = 4
+
+DEFAULT_OUTPUTFN_FMT = inspect.signature(downsize_pptx_images).parameters['outputfn_fmt'].default
+
+
+def output_filename(filename, outputfn_fmt=DEFAULT_OUTPUTFN_FMT):
+    """Return the output filename of a presentation, see the `outputfn_fmt` argument of `downsize_pptx_images`."""
+    return outputfn_fmt.format(filename=filename, fnroot=os.path.splitext(filename)[0])
+
+
+def find_presentations(paths, outputfn_fmt=DEFAULT_OUTPUTFN_FMT):
+    """Find the presentations to downsize.
+
+    Args:
+        paths: List of pptx filenames, directories (searched recursively for pptx files),
+            and glob patterns, e.g. 'talks/**/*.pptx'.
+        outputfn_fmt: The output filename format. Files that are the output of other presentations
+            that were found, e.g. 'talk.downsized.pptx' next to 'talk.pptx', are skipped.
+
+    Returns:
+        List of pptx filenames, without duplicates, in the order given (directories and globs sorted by name).
+        Filenames given explicitly are included even if they do not exist.
+
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, fnames in os.walk(path):
+                dirnames.sort()
+                found.extend(os.path.join(dirpath, fname) for fname in sorted(fnames)
+                             if fname.lower().endswith(".pptx") and not fname.startswith("~$"))  # "~$": Lock files.
+        elif any(char in path for char in "*?["):
+            found.extend(find_presentations(sorted(glob.glob(path, recursive=True)), outputfn_fmt=outputfn_fmt))
+        else:
+            found.append(path)
+    filenames = list(dict.fromkeys(os.path.normpath(filename) for filename in found))
+    outputs = {os.path.normpath(output_filename(filename, outputfn_fmt)) for filename in filenames}
+    return [filename for filename in filenames if filename not in outputs]
+
+
+class ThreadOutput(io.TextIOBase):
+    """Text stream that buffers the output of capturing threads separately.
+
+    Used as `sys.stdout`, so the output of presentations processed at the same time is not interleaved.
+    Output from other threads is written directly to the underlying stream.
+    """
+
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+        self._local = threading.local()
+
+    def write(self, s):
+        buffer = getattr(self._local, 'buffer', None)
+        return (self.stream if buffer is None else buffer).write(s)
+
+    def flush(self):
+        self.stream.flush()
+
+    @contextmanager
+    def capture(self):
+        """Context manager capturing the output of the current thread, yielding the `io.StringIO` buffer."""
+        self._local.buffer = io.StringIO()
+        try:
+            yield self._local.buffer
+        finally:
+            self._local.buffer = None
+
+
+def downsize_captured(output, filename, **kwargs):
+    """Downsize a presentation, capturing its output (see `ThreadOutput`) and any errors.
+
+    Returns:
+        (result, text) tuple, where the result is the output filename or the exception raised,
+        and text is the captured output.
+    """
+    with output.capture() as buffer:
+        try:
+            if not os.path.isfile(filename):
+                raise FileNotFoundError("No such file: %r" % (filename,))
+            result = downsize_pptx_images(filename, overwrite=True, **kwargs)
+        except Exception as e:
+            result = e
+        return result, buffer.getvalue()
+
+
+def downsize_pptx_files(
+        filenames, max_concurrent=MAX_CONCURRENT, jobs=None, executor='process',
+        outputfn_fmt=DEFAULT_OUTPUTFN_FMT, overwrite=None, **kwargs):
+    """Downsize many presentations, converting the images of all presentations with one shared worker pool.
+
+    The output of each presentation is printed when the presentation is done.
+    Errors are printed and returned, so one failing presentation does not stop the others.
+
+    Args:
+        filenames: The pptx files to downsize, e.g. as returned by `find_presentations`.
+        max_concurrent: The maximum number of presentations processed at the same time.
+        jobs: Number of image conversion workers, shared by all presentations (default: one per CPU).
+        executor: The kind of worker pool, 'process', 'thread', or 'serial', or an existing executor.
+        outputfn_fmt: The filename format of the downsized presentations.
+        overwrite: Whether to overwrite existing output files. If not, presentations where the output file
+            already exists are skipped (since we cannot prompt the user for each presentation).
+        **kwargs: Other keyword arguments for `downsize_pptx_images`.
+
+    Returns:
+        dict mapping each filename to the output filename, or the exception raised if the presentation
+        could not be downsized, or None if the presentation was skipped.
+
+    """
+    verbose = kwargs.get('verbose', 2)
+    results = dict.fromkeys(filenames)
+    todo = []
+    for filename in filenames:
+        if not overwrite and os.path.exists(output_filename(filename, outputfn_fmt)):
+            print("Skipping %r, the output file already exists (use `--overwrite` to replace it)." % (filename,))
+        else:
+            todo.append(filename)
+    print("\nDownsizing %s presentations, %s at a time..." % (len(todo), min(max_concurrent, len(todo))))
+    stdout = sys.stdout
+    sys.stdout = output = ThreadOutput(stdout)
+    try:
+        with get_executor(executor, jobs=jobs) as pool, ThreadPoolExecutor(max_workers=max_concurrent) as decks:
+            futures = {decks.submit(downsize_captured, output, filename, executor=pool, outputfn_fmt=outputfn_fmt,
+                                    **kwargs): filename for filename in todo}
+            for future in as_completed(futures):
+                filename = futures[future]
+                result, text = future.result()
+                results[filename] = result
+                if verbose and verbose > 0:
+                    stdout.write(text)
+                if isinstance(result, Exception):
+                    stdout.write("\nERROR downsizing %r: %s: %s\n" % (filename, type(result).__name__, result))
+                stdout.flush()
+    finally:
+        sys.stdout = stdout
+    failed = [filename for filename, result in results.items() if isinstance(result, Exception)]
+    print("\nDownsized %s of %s presentations." % (len(todo) - len(failed), len(filenames)))
+    if failed:
+        print("Failed:\n" + "\n".join("  %s" % filename for filename in failed))
+    return results
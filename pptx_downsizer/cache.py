@@ -0,0 +1,99 @@
+"""
+
+Persistent on-disk cache of image conversion results.
+
+Converted images are stored under a key derived from the original image data and the conversion parameters,
+so the same image converted with the same parameters is only ever converted once, even across runs.
+The cache is size-bounded; when it grows above the limit, the least recently used entries are evicted.
+
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import PIL
+
+
+# Bump this whenever the conversion output for the same input/parameters may change:
+CACHE_VERSION = 4
+
+
+class ConversionCache:
+    """Content-addressed, size-bounded (LRU) cache of image conversion results.
+
+    Each entry is stored as two files, `<key>.dat` with the converted image data,
+    and `<key>.json` with the remaining (json-serializable) result values.
+    Entries are written atomically, so the cache can be shared between concurrent runs.
+    The modification time of the data file is used to track when the entry was last used.
+    """
+
+    def __init__(self, cache_dir, max_size=2**30):
+        """Open (or create) cache in directory `cache_dir`, holding at most `max_size` bytes."""
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_size = max_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.size = sum(os.path.getsize(fpath) for fpath, _ in self._entries())
+
+    @staticmethod
+    def make_key(data, **params):
+        """Create cache key from the original image data and all parameters that affect the conversion output."""
+        params = dict(params, pil_version=PIL.__version__, cache_version=CACHE_VERSION)
+        hasher = hashlib.sha256(data)
+        hasher.update(json.dumps(params, sort_keys=True, default=repr).encode('utf-8'))
+        return hasher.hexdigest()
+
+    def _path(self, key, ext):
+        return os.path.join(self.cache_dir, key[:2], key + ext)
+
+    def _entries(self):
+        """Generate (data file path, mtime) for all entries in the cache."""
+        for dirpath, dirnames, filenames in os.walk(self.cache_dir):
+            for fname in filenames:
+                if fname.endswith(".dat"):
+                    fpath = os.path.join(dirpath, fname)
+                    try:
+                        yield fpath, os.path.getmtime(fpath)
+                    except FileNotFoundError:
+                        pass  # Evicted by a concurrent run.
+
+    def get(self, key):
+        """Return cached result dict for `key`, or None if `key` is not in the cache."""
+        try:
+            with open(self._path(key, ".json")) as fd:
+                result = json.load(fd)
+            with open(self._path(key, ".dat"), 'rb') as fd:
+                result['data'] = fd.read()
+            os.utime(self._path(key, ".dat"))  # Mark entry as recently used.
+        except (FileNotFoundError, ValueError):
+            return None
+        return result
+
+    def put(self, key, result):
+        """Add conversion `result` dict to the cache. The 'messages' and 'timings' of the result are not cached."""
+        meta = {k: v for k, v in result.items() if k not in ('data', 'messages', 'timings')}
+        os.makedirs(os.path.dirname(self._path(key, "")), exist_ok=True)
+        # Write the metadata first; entries without a data file are never returned by `get`.
+        for ext, content, mode in ((".json", json.dumps(meta), 'w'), (".dat", result['data'], 'wb')):
+            tmpfd, tmpfn = tempfile.mkstemp(dir=os.path.dirname(self._path(key, "")), suffix=".tmp")
+            with open(tmpfd, mode) as fd:
+                fd.write(content)
+            os.replace(tmpfn, self._path(key, ext))
+        self.size += len(result['data'])
+        if self.max_size and self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is below 90% of its max size."""
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self.size = sum(os.path.getsize(fpath) for fpath, _ in entries)
+        for fpath, mtime in entries:
+            if self.size <= 0.9*self.max_size:
+                break
+            try:
+                self.size -= os.path.getsize(fpath)
+                os.remove(fpath)
+                os.remove(fpath[:-len(".dat")] + ".json")
+            except FileNotFoundError:
+                pass
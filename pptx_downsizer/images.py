@@ -0,0 +1,603 @@
+"""
+
+Image conversion functions used by pptx-downsizer.
+
+The functions in this module operate on raw image data (bytes) rather than filenames,
+and return plain data structures, so they can be run in worker processes.
+
+"""
+
+import io
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageChops, ImageStat
+
+from pptx_downsizer.png import encode_png
+
+
+def probe_image(zipfd, zinfo):
+    """Read the header of an image in a zip archive, without decoding the image data.
+
+    Args:
+        zipfd: The `zipfile.ZipFile` containing the image.
+        zinfo: The `ZipInfo` of the image member.
+
+    Returns:
+        dict with the image `width`, `height`, `mode`, `format`, whether it has several frames (`animated`),
+        and the number of bits per pixel used to store the image (`bpp`),
+        or None if the member is not an image that can be read.
+
+    """
+    with zipfd.open(zinfo) as fd:
+        try:
+            img = Image.open(fd)
+        except IMAGE_ERRORS:
+            return None
+        if img.format == 'WMF':
+            return None  # Pillow can identify vector images (WMF/EMF), but not rasterize them.
+        width, height = img.size
+        return {
+            'width': width,
+            'height': height,
+            'mode': img.mode,
+            'format': img.format,
+            # Unlike `n_frames`, `is_animated` only looks for a second frame, rather than reading all of them:
+            'animated': getattr(img, 'is_animated', False),
+            'bpp': 8*zinfo.file_size / max(width*height, 1),
+        }
+
+
+# Resampling filters available for resizing images. 'reduce' uses integer scale factors only (fastest).
+RESAMPLE_FILTERS = {
+    'lanczos': Image.LANCZOS,
+    'bicubic': Image.BICUBIC,
+    'hamming': Image.HAMMING,
+    'bilinear': Image.BILINEAR,
+    'box': Image.BOX,
+    'nearest': Image.NEAREST,
+    'reduce': Image.BOX,
+}
+
+# Errors raised by PIL when an image cannot be decoded or encoded (e.g. unsupported mode, truncated data):
+IMAGE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+# Image modes supported by `Image.reduce` (e.g. not 16-bit 'I;16' images); other images are resized instead:
+REDUCE_MODES = ('L', 'LA', 'La', 'RGB', 'RGBA', 'RGBa', 'RGBX', 'CMYK', 'YCbCr', 'LAB', 'HSV', 'I', 'F')
+
+# Formats where the encoded size can be reduced by reducing the `quality` save parameter:
+LOSSY_FORMATS = ('JPEG', 'WEBP')
+
+# When resizing with a filter, first reduce the image by an integer factor (or JPEG draft mode),
+# as long as the image stays at least this many times larger than the final size (like `Image.thumbnail`).
+# Results are practically indistinguishable from resizing the full image, but much faster for large factors.
+REDUCING_GAP = 2.0
+
+
+def fit_size(size, max_size, resample='lanczos', render_size=None):
+    """Return the size an image of the given size should be downscaled to.
+
+    Args:
+        size: The current (width, height) of the image.
+        max_size: The maximum width and height of the image, in pixels.
+        resample: The resampling filter name. For 'reduce', the image is scaled by an integer factor.
+            Otherwise the image is scaled to fit max_size (and render_size) exactly.
+        render_size: The (width, height) the image needs to have to be displayed at the desired resolution.
+            The image is downscaled to this size, as long as both width and height stay at least this large.
+
+    Returns:
+        The new (width, height), or the current size if the image should not be downscaled.
+
+    """
+    max_scale = max_size / max(size) if max_size else 1
+    render_scale = max(render_size[0] / size[0], render_size[1] / size[1]) if render_size else 1
+    if resample == 'reduce':
+        downscalefactor = max(
+            -(-max(size) // max_size) if max_size else 1,  # Ceiling division: Smallest factor that fits max_size.
+            int(1 / render_scale) if render_scale > 0 else 1,  # Largest factor that keeps the render size.
+        )
+        return tuple(max(v // downscalefactor, 1) for v in size)
+    scale = min(max_scale, render_scale)
+    if scale >= 1:
+        return tuple(size)
+    return tuple(min(max(round(v*scale), 1), max_size or v) for v in size)
+
+
+def reduce_image(img, size, resample='lanczos', box=None, messages=None, timings=None):
+    """Downscale image to the given size, decoding as little of the original image as possible.
+
+    For JPEG images, the decoder is put in draft mode, so the image is downscaled
+    in the DCT domain (by 1/2, 1/4 or 1/8) while decoding, which is much faster and uses less memory.
+    If the (remaining) scale factor is an integer, the image is reduced using `Image.reduce`,
+    otherwise the image is resized using the given resampling filter.
+    Palette (P) and bilevel (1) images are converted to RGB(A) and L first, since PIL resizes them with NEAREST.
+
+    Args:
+        img: The `PIL.Image` to downscale, preferably not yet loaded.
+        size: The new (width, height) of the image.
+        resample: The name of the resampling filter to use, see `RESAMPLE_FILTERS`.
+        box: Optional (left, upper, right, lower) region of the image to keep, i.e. crop the image to this box.
+        messages: If given, append messages describing the steps taken to this list.
+        timings: If given, the time spent decoding the image (in seconds) is stored in this dict, as 'decode'.
+
+    Returns:
+        The downscaled image.
+
+    """
+    messages = [] if messages is None else messages
+    size = tuple(size)
+    box = (0, 0) + img.size if box is None else tuple(box)
+    if img.format == 'JPEG':
+        # Only has an effect before the image data is loaded.
+        # For filtered resizing, keep some extra resolution for the filter to work with:
+        gap = 1 if resample == 'reduce' else REDUCING_GAP
+        orig_size = img.size
+        img.draft(img.mode, tuple(
+            min(int(v*gap*orig/boxsize), orig) for v, orig, boxsize in zip(size, orig_size, (box[2]-box[0], box[3]-box[1]))
+        ))
+        if img.size != orig_size:
+            messages.append(" - Decoding JPEG in draft mode at %s" % (img.size,))
+            box = tuple(int(round(v * img.size[i % 2] / orig_size[i % 2])) for i, v in enumerate(box))
+    if timings is not None:
+        start = time.perf_counter()
+        img.load()  # Otherwise the image is decoded while resizing.
+        timings['decode'] = time.perf_counter() - start
+    box_size = (box[2]-box[0], box[3]-box[1])
+    if box_size == size:
+        return img if box == (0, 0) + img.size else img.crop(box)
+    if img.mode in ('1', 'P', 'PA') and resample != 'nearest':
+        # PIL always resizes palette and bilevel images with NEAREST, so filter them in a full color mode instead:
+        new_mode = 'L' if img.mode == '1' else 'RGBA' if (img.mode == 'PA' or 'transparency' in img.info) else 'RGB'
+        messages.append(" - Changing image mode from %s to %s for resizing" % (img.mode, new_mode))
+        img = img.convert(new_mode)
+    factor = box_size[0] // size[0]
+    if (factor > 1 and box_size[0] // factor == size[0] and box_size[1] // factor == size[1]
+            and (resample == 'reduce' or factor <= REDUCING_GAP) and img.mode in REDUCE_MODES):
+        return img.reduce(factor, box=(box[0], box[1], box[0] + size[0]*factor, box[1] + size[1]*factor))
+    return img.resize(size, RESAMPLE_FILTERS[resample], box=box, reducing_gap=REDUCING_GAP)
+
+
+def encode_image(img, output_format, png_effort=None, messages=None, **save_kwargs):
+    """Encode image in the given format, returning the image file data (bytes).
+
+    If `png_effort` is given, PNG images are encoded with `encode_png` at this effort level (0-6),
+    instead of `PIL.Image.save`.
+    """
+    if png_effort is not None and output_format.upper() == 'PNG':
+        return encode_png(img, png_effort, messages=messages)
+    outfd = io.BytesIO()
+    # extra/unused kwargs to Image.save are silently ignored (e.g. `quality` for png)
+    img.save(outfd, format=output_format, **save_kwargs)
+    return outfd.getvalue()
+
+
+def encode_to_budget(img, output_format, target_size, quality=90, min_quality=30, optimize=True,
+                     resample='lanczos', max_attempts=5, png_effort=None, messages=None):
+    """Encode image so the output is no larger than `target_size` bytes.
+
+    For lossy formats (JPEG, WebP), we binary-search for the highest quality (between `min_quality` and `quality`)
+    that fits the budget. If the image does not fit even at `min_quality` (or the format is lossless),
+    the image is downscaled and we try again. The image is only decoded once; all attempts are
+    encoded in memory from the same decoded pixels.
+
+    Args:
+        img: The `PIL.Image` to encode.
+        output_format: The image format to encode to, e.g. 'jpeg'.
+        target_size: The maximum size of the encoded image, in bytes.
+        quality: The highest (preferred) quality.
+        min_quality: The lowest acceptable quality, before we start downscaling the image.
+        optimize: Passed to `PIL.Image.save`.
+        resample: The resampling filter used if the image must be downscaled.
+        max_attempts: The maximum number of times to downscale the image.
+        png_effort: PNG optimization effort level, see `encode_image`.
+        messages: If given, append messages describing the result to this list.
+
+    Returns:
+        The encoded image data (bytes). If the budget could not be met, the smallest encoding found is returned.
+
+    """
+    messages = [] if messages is None else messages
+    lossy = output_format.upper() in LOSSY_FORMATS
+    img.load()
+    scaled = img
+    for attempt in range(max_attempts + 1):
+        data = encode_image(scaled, output_format, optimize=optimize, png_effort=png_effort, quality=quality)
+        if len(data) <= target_size:
+            break
+        if lossy:
+            low = encode_image(scaled, output_format, optimize=optimize, png_effort=png_effort, quality=min_quality)
+            if len(low) <= target_size:
+                # Binary search: `lo` always fits the budget, `hi` never does.
+                lo, hi, data = min_quality, quality, low
+                while hi - lo > 1:
+                    mid = (lo + hi) // 2
+                    candidate = encode_image(scaled, output_format, optimize=optimize, png_effort=png_effort, quality=mid)
+                    if len(candidate) > target_size:
+                        hi = mid
+                        continue
+                    lo, data = mid, candidate
+                    if len(candidate) > 0.95*target_size:
+                        break  # Close enough to the budget, no need to keep searching.
+                messages.append(" - Reduced quality to %s to fit the %s kb budget" % (lo, target_size // 1024))
+                break
+            data = low
+        if attempt == max_attempts:
+            break
+        # The encoded size is roughly proportional to the number of pixels:
+        scale = min(0.9, 0.95 * (target_size / len(data))**0.5) * scaled.width / img.width
+        newsize = (max(round(img.width*scale), 1), max(round(img.height*scale), 1))
+        scaled = img.resize(newsize, RESAMPLE_FILTERS[resample], reducing_gap=REDUCING_GAP)
+        messages.append(" - Downscaling to %s to fit the %s kb budget" % (newsize, target_size // 1024))
+    return data
+
+
+# Candidate formats for `convert_to='auto'`, mapping name -> (PIL format, file extension).
+# 'png8' is a palette (max 256 colors) PNG. WebP is only supported by recent PowerPoint versions (Office 2019+).
+AUTO_FORMATS = {
+    'png': ('PNG', '.png'),
+    'png8': ('PNG', '.png'),
+    'jpeg': ('JPEG', '.jpeg'),
+    'webp': ('WEBP', '.webp'),
+}
+
+# File extension used for converted images, by PIL format:
+FORMAT_EXTENSIONS = {'PNG': '.png', 'JPEG': '.jpeg', 'WEBP': '.webp'}
+
+
+def has_alpha(img):
+    """Return True if image has any (partially) transparent pixels."""
+    if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+        return img.convert('RGBA').getchannel('A').getextrema()[0] < 255
+    return False
+
+
+def psnr(img1, img2):
+    """Return the peak signal-to-noise ratio (in dB) between two images of the same size (inf if identical)."""
+    mode = 'RGBA' if has_alpha(img1) or has_alpha(img2) else 'RGB'
+    diff = ImageChops.difference(img1.convert(mode), img2.convert(mode))
+    mse = sum(ImageStat.Stat(diff).sum2) / (diff.width * diff.height * len(mode))
+    return 10 * math.log10(255**2 / mse) if mse else math.inf
+
+
+# Images with at most this many colors in a downsampled copy are considered low-color images
+# (e.g. screenshots and diagrams), which can usually be stored as palette images without visible loss:
+LOW_COLOR_LIMIT = 4096
+
+
+def _nearest_thumbnail(img, max_size=256):
+    """Return downsampled copy of image, using only colors that are present in the image."""
+    scale = max_size / max(img.size)
+    if scale >= 1:
+        return img
+    return img.resize((max(round(img.width*scale), 1), max(round(img.height*scale), 1)), Image.NEAREST)
+
+
+def quantize_image(img, max_colors=256, palette=None):
+    """Convert image to a palette ('P') image with at most `max_colors` colors.
+
+    If the image has no more than `max_colors` colors, the palette contains exactly the colors of the image,
+    so the conversion is lossless (and PNG stores images with few colors using fewer bits per pixel).
+    Otherwise the image is quantized, using the colors of `palette` (a 'P' image), if given.
+    """
+    img = img.convert('RGBA' if has_alpha(img) else 'RGB')
+    colors = img.getcolors(max_colors) if img.mode == 'RGB' else None
+    if colors:
+        palette = Image.new('P', (1, 1))
+        palette.putpalette([value for count, color in colors for value in color])
+        return img.quantize(palette=palette, dither=Image.NONE)
+    if palette is not None and img.mode == 'RGB':
+        return img.quantize(palette=palette)
+    return img.quantize(max_colors, method=Image.FASTOCTREE if img.mode == 'RGBA' else Image.MEDIANCUT)
+
+
+def reduce_colors(img, max_colors=256, min_psnr=38.0, messages=None):
+    """Convert low-color images (e.g. screenshots and diagrams) to palette images, if that preserves their appearance.
+
+    Colors are first counted in a small downsampled copy of the image, so images with many colors
+    (e.g. photos) are rejected quickly, without quantizing the whole image.
+
+    Args:
+        img: The `PIL.Image` to convert.
+        max_colors: The maximum number of colors in the palette (at most 256).
+        min_psnr: The lowest acceptable peak signal-to-noise ratio (in dB) of the palette image.
+        messages: If given, append messages describing the result to this list.
+
+    Returns:
+        The palette image, or None if the image is not a low-color image (or already a palette/grayscale image).
+
+    """
+    messages = [] if messages is None else messages
+    if img.mode not in ('RGB', 'RGBA', 'LA'):
+        return None
+    if _nearest_thumbnail(img).getcolors(LOW_COLOR_LIMIT) is None:
+        return None
+    quantized = quantize_image(img, max_colors)
+    fidelity = psnr(img, quantized)
+    if fidelity < min_psnr:
+        messages.append(" - Not using a palette, quantizing to %s colors gives %0.01f dB" % (max_colors, fidelity))
+        return None
+    messages.append(" - Using a %s-color palette (%0.01f dB)" % (
+        len(quantized.palette.getdata()[1]) // len(quantized.palette.mode), fidelity))
+    return quantized
+
+
+def candidate_image(img, candidate, palette=None):
+    """Return image converted to a mode that can be saved as one of the `AUTO_FORMATS` candidates.
+
+    For 'png8', the image is quantized to 256 colors, or to the colors of `palette` (a 'P' image), if given.
+    Returns None if the image cannot be stored in this format (e.g. transparent images as JPEG).
+    """
+    if AUTO_FORMATS[candidate][0] == 'JPEG':
+        if has_alpha(img):
+            return None
+        if img.mode not in ('L', 'RGB', 'CMYK'):
+            img = img.convert('RGB')
+    elif candidate == 'png8':
+        if img.mode not in ('P', '1', 'L'):
+            img = quantize_image(img, 256, palette=palette)
+    return img
+
+
+def encode_candidate(img, candidate, quality=90, optimize=True, palette=None, png_effort=None):
+    """Encode image as one of the `AUTO_FORMATS` candidates, returning the image data (bytes) or None."""
+    img = candidate_image(img, candidate, palette=palette)
+    if img is None:
+        return None
+    return encode_image(img, AUTO_FORMATS[candidate][0], optimize=optimize, quality=quality, png_effort=png_effort)
+
+
+def encode_best(img, candidates=('png', 'png8', 'jpeg'), quality=90, optimize=True, min_psnr=38.0, palette=None,
+                png_effort=None, messages=None):
+    """Encode image in several formats, and return the smallest encoding that is close enough to the original.
+
+    All candidates are encoded in parallel threads from the same decoded image (encoding releases the GIL).
+    Lossless PNG is always included as fallback.
+
+    Args:
+        img: The `PIL.Image` to encode.
+        candidates: The candidate formats to try, see `AUTO_FORMATS`.
+        quality: The quality used for the lossy formats.
+        optimize: Passed to `PIL.Image.save`.
+        min_psnr: The lowest acceptable peak signal-to-noise ratio (in dB) for lossy candidates.
+        palette: Optional palette image used for the 'png8' candidate, see `candidate_image`.
+        png_effort: PNG optimization effort level, see `encode_image`.
+        messages: If given, append messages describing the result to this list.
+
+    Returns:
+        (data, candidate) tuple with the encoded image data (bytes) and the selected candidate format.
+
+    """
+    messages = [] if messages is None else messages
+    candidates = list(dict.fromkeys(('png',) + tuple(candidates)))
+    img.load()
+    with ThreadPoolExecutor(max_workers=len(candidates)) as pool:
+        encoded = dict(zip(candidates, pool.map(
+            lambda candidate: encode_candidate(img, candidate, quality=quality, optimize=optimize, palette=palette,
+                                               png_effort=png_effort),
+            candidates)))
+    results = []
+    for candidate, data in encoded.items():
+        if data is None:
+            continue
+        if candidate == 'png' or len(data) >= len(encoded['png']):
+            fidelity = math.inf  # No need to decode lossless or larger candidates.
+        else:
+            fidelity = psnr(img, Image.open(io.BytesIO(data)))
+        sizes = "%s: %s kb" % (candidate, len(data) // 1024)
+        if fidelity < min_psnr:
+            sizes += " (%0.01f dB, rejected)" % fidelity
+        results.append((fidelity >= min_psnr, len(data), candidate, sizes))
+    best = min((len(encoded[c]), i, c) for i, (ok, size, c, _) in enumerate(results) if ok)[2]
+    messages.append(" - Format candidates: %s; using %s." % (", ".join(r[3] for r in results), best))
+    return encoded[best], best
+
+
+def prepare_image(
+    data,
+    img_max_size=2048,
+    resample='lanczos',
+    render_size=None,
+    crop=None,
+    scale=1.0,
+    img_mode=None,
+    fill_color=None,
+    messages=None,
+    timings=None,
+):
+    """Decode, crop, downscale and change mode of an image, i.e. everything except encoding it.
+
+    Args:
+        data: The raw image file data (bytes).
+        img_max_size: Downscale the image if it is larger than this limit (width or height, in pixels).
+        resample: The resampling filter used to downscale images, see `RESAMPLE_FILTERS`.
+        render_size: The (width, height) in pixels needed to display the image on the slides.
+            If given, the image is downscaled to this size (if it is larger).
+            When cropping, the render size is the size needed for the cropped image.
+        crop: Optional (left, top, right, bottom) fractions of the image to crop away, before downscaling.
+        scale: Additional downscaling factor, applied after fitting the image to `img_max_size` and `render_size`.
+        img_mode: Convert images to this mode before saving - e.g. 'RGB'.
+        fill_color: If converting images with alpha channels, use this color as background/fill color.
+        messages: If given, append messages describing the steps taken to this list.
+        timings: If given, the time spent (in seconds) decoding the image, and cropping, resizing and
+            changing the mode of the image, is stored in this dict, as 'decode' and 'resize'.
+
+    Returns:
+        The prepared `PIL.Image`.
+
+    """
+    messages = [] if messages is None else messages
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    img = Image.open(io.BytesIO(data))
+    box = None
+    if crop:
+        left, top, right, bottom = crop
+        box = (round(left*img.width), round(top*img.height),
+               img.width - round(right*img.width), img.height - round(bottom*img.height))
+        messages.append(" - Cropping from %s to %s" % (img.size, box))
+    region_size = (box[2]-box[0], box[3]-box[1]) if box else img.size
+    newsize = fit_size(region_size, img_max_size, resample, render_size)
+    if scale < 1:
+        newsize = tuple(max(round(v*scale), 1) for v in newsize)
+    if newsize != region_size:
+        messages.append(" - Resizing %0.02fx, from %s to %s (%s)" % (
+            region_size[0]/newsize[0], region_size, newsize, resample))
+        img = reduce_image(img, newsize, resample, box, messages, timings)
+    else:
+        decode_start = time.perf_counter()
+        img.load()
+        timings['decode'] = time.perf_counter() - decode_start
+        if box:
+            img = img.crop(box)
+    if img_mode:
+        messages.append(" - Changing image mode from %s to %s (fill color: %s)..." % (img_mode, img.mode, fill_color))
+        if fill_color:
+            # From https://stackoverflow.com/questions/9166400/convert-rgba-png-to-rgb-with-pil
+            img.load()  # needed for split()
+            background = Image.new(img_mode, img.size, fill_color)
+            background.paste(img, mask=img.split()[3])  # 3 is the alpha channel
+            img = background
+        else:
+            img = img.convert(img_mode)
+    timings['resize'] = time.perf_counter() - start - timings['decode']
+    return img
+
+
+def _sample_tiles(img, tile_size=128, grid=4):
+    """Return a small mosaic of tiles spread evenly over the image, for estimating the encoded size of the image.
+
+    Unlike a downscaled copy, the tiles keep the fine details (and thus compressibility) of the original image.
+    Small images are returned as-is.
+    """
+    tile_w, tile_h = min(tile_size, img.width), min(tile_size, img.height)
+    if img.width <= tile_w*grid and img.height <= tile_h*grid:
+        return img
+    sample = Image.new(img.mode, (tile_w*grid, tile_h*grid))
+    if img.mode == 'P':
+        sample.putpalette(img.getpalette())
+    for i in range(grid):
+        for j in range(grid):
+            x, y = (img.width - tile_w) * i // (grid - 1), (img.height - tile_h) * j // (grid - 1)
+            sample.paste(img.crop((x, y, x + tile_w, y + tile_h)), (i*tile_w, j*tile_h))
+    return sample
+
+
+def estimate_image(data, output_format, qualities, optimize=True, png_effort=None, quantize_colors=256,
+                   auto_formats=('png', 'png8', 'jpeg'), min_psnr=38.0, **prepare_kwargs):
+    """Estimate the converted size of an image at different qualities, by encoding a small sample of the image.
+
+    Args:
+        data: The raw image file data (bytes).
+        output_format: The image format to save the converted image as, e.g. 'png' or 'jpeg'.
+            If 'auto', the format is selected from `auto_formats` (see `encode_best`), using the sample.
+        qualities: The qualities to estimate the size at.
+            For lossless formats, the image is only encoded once, and the estimate is the same for all qualities.
+        optimize: Passed to `PIL.Image.save`.
+        png_effort: PNG optimization effort level, see `encode_image`.
+        quantize_colors: Palette size used for low-color images when saving as PNG, see `convert_image`.
+        auto_formats, min_psnr: The candidate formats and fidelity threshold used if `output_format` is 'auto'.
+        **prepare_kwargs: Keyword arguments for `prepare_image`, e.g. `img_max_size` and `crop`.
+
+    Returns:
+        dict with the prepared image `size` (width, height), and the estimated encoded `sizes`
+        (a dict mapping quality -> bytes).
+
+    """
+    img = prepare_image(data, **prepare_kwargs)
+    if quantize_colors and output_format.upper() == 'PNG':
+        img = reduce_colors(img, quantize_colors, min_psnr=min_psnr) or img
+    sample = _sample_tiles(img)
+    pixel_ratio = (img.width*img.height) / (sample.width*sample.height)
+    candidate = palette = None
+    if output_format == 'auto':
+        if 'png8' in auto_formats and sample is not img:
+            # The sample has fewer colors than the whole image, so quantize it using the palette of the whole image:
+            palette = quantize_image(_nearest_thumbnail(img.convert('RGB'), 512), 256)
+        candidate = encode_best(sample, auto_formats, quality=max(qualities), optimize=optimize, min_psnr=min_psnr,
+                                palette=palette, png_effort=png_effort)[1]
+        sample, output_format = candidate_image(sample, candidate, palette=palette), AUTO_FORMATS[candidate][0]
+    sizes = {}
+    for quality in sorted(qualities, reverse=True):
+        if output_format.upper() in LOSSY_FORMATS or not sizes:
+            sample_size = len(encode_image(sample, output_format, optimize=optimize, quality=quality,
+                                           png_effort=png_effort))
+        sizes[quality] = int(sample_size * pixel_ratio)
+    return {'size': img.size, 'sizes': sizes, 'candidate': candidate}
+
+
+def convert_image(
+    data,
+    output_format,
+    img_max_size=2048,
+    resample='lanczos',
+    render_size=None,
+    crop=None,
+    scale=1.0,
+    quality=90,
+    target_image_size=None,
+    min_quality=30,
+    optimize=True,
+    png_effort=None,
+    img_mode=None,
+    fill_color=None,
+    quantize_colors=256,
+    auto_formats=('png', 'png8', 'jpeg'),
+    min_psnr=38.0,
+):
+    """Convert a single image, given as raw bytes.
+
+    This is the unit of work that is distributed to the image executor,
+    so it must be a module-level function and only take/return picklable values.
+
+    Args:
+        data: The raw image file data (bytes).
+        output_format: The image format to save the converted image as, e.g. 'png' or 'jpeg'.
+            If 'auto', the image is encoded in all `auto_formats`, and the smallest result is used,
+            as long as its peak signal-to-noise ratio is at least `min_psnr` (see `encode_best`).
+        img_max_size, resample, render_size, crop, scale, img_mode, fill_color:
+            How to prepare the image before encoding, see `prepare_image`.
+        quality: Save images with this quality parameter (JPEG only).
+        target_image_size: If given, reduce quality (down to `min_quality`) and then image size,
+            until the converted image is no larger than this many bytes.
+        min_quality: The lowest quality to use when trying to reach `target_image_size`.
+        optimize: Attempt to optimize the image output (for `PIL.Image.save`)
+        png_effort: If given, optimize PNG images with this effort level, 0-6 (instead of `optimize`),
+            see `pptx_downsizer.png.encode_png`.
+        quantize_colors: When saving as PNG, store low-color images (e.g. screenshots) as palette images
+            with at most this many colors, if the peak signal-to-noise ratio is at least `min_psnr`
+            (see `reduce_colors`). 0 or None disables palette quantization.
+
+    Returns:
+        dict with the converted image `data` (bytes), the image `format` (e.g. 'PNG'), its `size` (width, height),
+        a list of `messages`, to be printed by the caller (so output is not interleaved between workers),
+        and the `timings` (in seconds) of the 'decode', 'resize', and 'encode' steps.
+        Except for the messages and timings, the result only depends on the input arguments, so it can be cached.
+
+    """
+    messages = []
+    timings = {}
+    img = prepare_image(data, img_max_size=img_max_size, resample=resample, render_size=render_size, crop=crop,
+                        scale=scale, img_mode=img_mode, fill_color=fill_color, messages=messages, timings=timings)
+    start = time.perf_counter()
+    if quantize_colors and output_format.upper() == 'PNG':
+        img = reduce_colors(img, quantize_colors, min_psnr=min_psnr, messages=messages) or img
+    if output_format == 'auto':
+        data, candidate = encode_best(img, auto_formats, quality=quality, optimize=optimize, min_psnr=min_psnr,
+                                      png_effort=png_effort, messages=messages)
+        output_format = AUTO_FORMATS[candidate][0]
+        if target_image_size and len(data) > target_image_size:
+            # Reduce quality/size in the selected format:
+            data = encode_to_budget(candidate_image(img, candidate), output_format, target_image_size,
+                                    quality=quality, min_quality=min_quality, optimize=optimize, resample=resample,
+                                    png_effort=png_effort, messages=messages)
+    elif target_image_size:
+        data = encode_to_budget(img, output_format, target_image_size, quality=quality, min_quality=min_quality,
+                                optimize=optimize, resample=resample, png_effort=png_effort, messages=messages)
+    else:
+        data = encode_image(img, output_format, optimize=optimize, quality=quality, png_effort=png_effort,
+                            messages=messages)
+    timings['encode'] = time.perf_counter() - start
+    # The size is read from the encoded image, since `encode_to_budget` may have downscaled the image further:
+    return {'data': data, 'format': output_format.upper(), 'size': list(Image.open(io.BytesIO(data)).size),
+            'messages': messages,
+            'timings': timings}
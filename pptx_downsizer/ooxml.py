@@ -0,0 +1,424 @@
+"""
+
+Functions for reading the Office Open XML (OOXML) package structure of pptx files,
+i.e. the relationships between parts, and how pictures are used on the slides.
+
+Parts are identified by their zip archive member name, e.g. 'ppt/slides/slide1.xml'.
+
+"""
+
+import mimetypes
+import posixpath
+import re
+import xml.etree.ElementTree as ET
+
+
+CONTENT_TYPES_PART = "[Content_Types].xml"
+
+# Content types of the media file extensions we may produce (other extensions are looked up with `mimetypes`):
+MEDIA_CONTENT_TYPES = {
+    'png': "image/png",
+    'jpeg': "image/jpeg",
+    'jpg': "image/jpeg",
+    'webp': "image/webp",
+    'gif': "image/gif",
+    'tif': "image/tiff",
+    'tiff': "image/tiff",
+}
+
+NS = {
+    'a': "http://schemas.openxmlformats.org/drawingml/2006/main",
+    'r': "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    'p': "http://schemas.openxmlformats.org/presentationml/2006/main",
+    'rel': "http://schemas.openxmlformats.org/package/2006/relationships",
+    'ct': "http://schemas.openxmlformats.org/package/2006/content-types",
+}
+
+# Sizes in DrawingML are given in English Metric Units (EMU):
+EMU_PER_INCH = 914400
+
+
+def rels_part_name(part_name):
+    """Return the name of the relationships part for the given part, e.g. 'ppt/_rels/presentation.xml.rels'."""
+    dirname, basename = posixpath.split(part_name)
+    return posixpath.join(dirname, "_rels", basename + ".rels")
+
+
+def source_part_name(rels_name):
+    """Return the name of the source part of a relationships part (inverse of `rels_part_name`).
+
+    For the package relationships, '_rels/.rels', the source part name is '' (the package itself).
+    """
+    reldir, basename = posixpath.split(rels_name)
+    return posixpath.join(posixpath.dirname(reldir), basename[:-len(".rels")])
+
+
+def resolve_target(source_part, target):
+    """Resolve relationship target (relative to the source part) to a part name."""
+    if target.startswith("/"):
+        return posixpath.normpath(target[1:])
+    return posixpath.normpath(posixpath.join(posixpath.dirname(source_part), target))
+
+
+def parse_rels(data):
+    """Parse relationships part data, returning a list of dicts with the attributes of each relationship.
+
+    The attributes are 'Id', 'Type', 'Target', and (optionally) 'TargetMode'.
+    """
+    root = ET.fromstring(data)
+    return [dict(rel.attrib) for rel in root.iter('{%s}Relationship' % NS['rel'])]
+
+
+def index_relationships(zipfd, members=None):
+    """Index which relationships parts refer to each part, parsing each relationships part once.
+
+    Args:
+        zipfd: The pptx `zipfile.ZipFile`.
+        members: The `ZipInfo` members of the zip archive (default: all members).
+
+    Returns:
+        dict mapping (target) part name -> list of the relationships parts with internal relationships to it.
+
+    """
+    members = zipfd.infolist() if members is None else members
+    index = {}
+    for zinfo in members:
+        if not zinfo.filename.endswith(".rels"):
+            continue
+        source_part = source_part_name(zinfo.filename)
+        targets = {resolve_target(source_part, rel['Target']) for rel in parse_rels(zipfd.read(zinfo))
+                   if rel.get('TargetMode') != "External"}
+        for target in targets:
+            index.setdefault(target, []).append(zinfo.filename)
+    return index
+
+
+def find_unreachable_parts(zipfd, members=None):
+    """Find the parts that cannot be reached by following relationships from the package relationships.
+
+    Such parts, e.g. images that are no longer used on any slide, are never used by PowerPoint.
+    The content types part is always reachable, as are the relationships parts of reachable parts.
+
+    Args:
+        zipfd: The pptx `zipfile.ZipFile`.
+        members: The `ZipInfo` members of the zip archive (default: all members).
+
+    Returns:
+        Set of the member names of all unreachable parts (including their relationships parts).
+        Empty if the package has no package relationships ('_rels/.rels'), i.e. is not a valid package.
+
+    """
+    members = zipfd.infolist() if members is None else members
+    names = {zinfo.filename for zinfo in members}
+    package_rels = rels_part_name("")
+    if package_rels not in names:
+        return set()
+    reachable = {""}  # The package itself.
+    todo = [""]
+    while todo:
+        rels_name = rels_part_name(todo.pop())
+        if rels_name not in names:
+            continue
+        for rel in parse_rels(zipfd.read(rels_name)):
+            target = resolve_target(source_part_name(rels_name), rel['Target'])
+            if rel.get('TargetMode') != "External" and target not in reachable:
+                reachable.add(target)
+                todo.append(target)
+    reachable.add(CONTENT_TYPES_PART)
+    reachable.update({rels_part_name(part) for part in reachable})
+    return {name for name in names if name not in reachable and not name.endswith("/")}
+
+
+def update_rel_targets(xml, source_part, renamed):
+    """Update the targets of the relationships to parts that have been renamed.
+
+    The xml is edited as text, to make sure that everything else in the part is kept exactly as-is.
+
+    Args:
+        xml: The relationships part's xml (str).
+        source_part: The name of the source part of the relationships, see `source_part_name`.
+        renamed: dict mapping old part name -> new part name.
+
+    Returns:
+        The updated xml (str).
+
+    """
+    def update_target(match):
+        prefix, target, quote = match.group(1), match.group(3), match.group(2)
+        part = resolve_target(source_part, target)
+        if part not in renamed:
+            return match.group(0)
+        if target.startswith("/"):
+            return prefix + "/" + renamed[part] + quote
+        return prefix + posixpath.relpath(renamed[part], posixpath.dirname(source_part) or ".") + quote
+
+    def update_relationship(match):
+        rel = match.group(0)
+        if re.search(r'\bTargetMode\s*=\s*["\']External["\']', rel):
+            return rel  # External targets are not parts of the package.
+        return re.sub(r'(\bTarget\s*=\s*(["\']))(.*?)\2', update_target, rel, count=1)
+
+    return re.sub(r'<(?:\w+:)?Relationship\b[^>]*>', update_relationship, xml)
+
+
+def update_content_types(xml, part_names):
+    """Update the content types part ([Content_Types].xml) for the parts of the output package.
+
+    A Default entry is added for each extension used by parts that do not have a content type (e.g. images
+    converted to a new format), and Default and Override entries that no longer apply to any part are removed.
+    Without a content type for every part, PowerPoint reports the presentation as needing repair.
+    The xml is edited as text, to make sure that everything else in the part is kept exactly as-is.
+
+    Args:
+        xml: The content types part's xml (str).
+        part_names: The names of all parts (zip archive members) in the output package.
+
+    Returns:
+        The updated xml (str).
+
+    """
+    root = ET.fromstring(xml)
+    defaults = {elem.get('Extension').lower() for elem in root.iter('{%s}Default' % NS['ct'])}
+    overrides = {elem.get('PartName').lower() for elem in root.iter('{%s}Override' % NS['ct'])}
+    part_names = [name for name in part_names if name != CONTENT_TYPES_PART and not name.endswith("/")]
+    extensions = {posixpath.splitext(name)[1][1:].lower() for name in part_names}
+    new_extensions = sorted({
+        posixpath.splitext(name)[1][1:].lower() for name in part_names
+        if "/" + name.lower() not in overrides and posixpath.splitext(name)[1][1:].lower() not in defaults} - {""})
+    used_parts = {"/" + name.lower() for name in part_names}
+
+    def keep_entry(match):
+        entry = match.group(0)
+        extension = re.search(r'\bExtension\s*=\s*["\']([^"\']*)["\']', entry)
+        if extension is not None and extension.group(1).lower() not in extensions:
+            return ""
+        part_name = re.search(r'\bPartName\s*=\s*["\']([^"\']*)["\']', entry)
+        if part_name is not None and part_name.group(1).lower() not in used_parts:
+            return ""
+        return entry
+
+    xml = re.sub(r'<((?:\w+:)?(?:Default|Override))\b[^>]*?(?:/>|>.*?</\1>)', keep_entry, xml, flags=re.DOTALL)
+    new_defaults = "".join('<Default Extension="%s" ContentType="%s"/>' % (
+        extension, MEDIA_CONTENT_TYPES.get(extension) or mimetypes.guess_type("part." + extension)[0]
+        or "application/octet-stream") for extension in new_extensions)
+    # Insert the new Default entries first, like Office does:
+    return re.sub(r'(<(?:\w+:)?Types\b[^>]*>)', lambda m: m.group(1) + new_defaults, xml, count=1)
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _child(elem, local_name):
+    """Return the first child of elem with the given local name (regardless of namespace), or None."""
+    for child in elem:
+        if _local_name(child.tag) == local_name:
+            return child
+    return None
+
+
+def _xfrm_ext(sppr):
+    """Return (cx, cy) extents from the `xfrm` of a shape properties (spPr/grpSpPr) element, or None."""
+    xfrm = _child(sppr, 'xfrm') if sppr is not None else None
+    ext = _child(xfrm, 'ext') if xfrm is not None else None
+    if ext is None:
+        return None
+    return int(ext.get('cx')), int(ext.get('cy'))
+
+
+def _src_rect(blip_fill):
+    """Return the (left, top, right, bottom) crop fractions of a blipFill element, (0, 0, 0, 0) if not cropped."""
+    src_rect = _child(blip_fill, 'srcRect')
+    if src_rect is None:
+        return 0.0, 0.0, 0.0, 0.0
+    # srcRect values are given in 1/1000th of a percent:
+    return tuple(int(src_rect.get(side, 0))/100000 for side in "ltrb")
+
+
+def _add_unknown_uses(uses, part, image_rels, rids):
+    """Add uses with unknown size (and no blipFill index) for the given image relationship ids of a part."""
+    for rid in sorted(set(rids) & set(image_rels)):
+        uses.setdefault(image_rels[rid], []).append({
+            'part': part, 'rid': rid, 'index': None, 'size': None, 'src_rect': (0.0, 0.0, 0.0, 0.0),
+        })
+
+
+def find_picture_uses(zipfd, members=None):
+    """Find all places where pictures (media parts) are used in the presentation.
+
+    For each picture (blip) in slides, layouts, masters, notes, etc, we find the displayed
+    size from the extents of the enclosing shape (adjusted for group scaling), and the crop (srcRect).
+    Slide backgrounds are displayed at the slide size. For uses where the displayed size cannot be
+    determined (e.g. tiled fills), the size is None. Pictures used in other ways (e.g. picture bullets,
+    VML drawings, or relationships we cannot find a blipFill for) have a use with size None and index None,
+    so they are neither cropped nor downscaled to a displayed size.
+
+    Args:
+        zipfd: The pptx `zipfile.ZipFile`.
+        members: The `ZipInfo` members of the zip archive (default: all members).
+
+    Returns:
+        dict mapping media part name -> list of uses, each use being a dict with
+        'part' (the part using the picture), 'rid', 'index' (the index of the blipFill element in the part, or None),
+        'size' ((cx, cy) in EMU or None), and 'src_rect' ((left, top, right, bottom) crop fractions).
+
+    """
+    members = zipfd.infolist() if members is None else members
+    names = {zinfo.filename for zinfo in members}
+    slide_size = None
+    if "ppt/presentation.xml" in names:
+        sld_sz = ET.fromstring(zipfd.read("ppt/presentation.xml")).find('p:sldSz', NS)
+        if sld_sz is not None:
+            slide_size = int(sld_sz.get('cx')), int(sld_sz.get('cy'))
+    uses = {}
+    for zinfo in members:
+        if not zinfo.filename.endswith(".rels"):
+            continue
+        part = source_part_name(zinfo.filename)
+        if part not in names:
+            continue
+        image_rels = {
+            rel['Id']: resolve_target(part, rel['Target']) for rel in parse_rels(zipfd.read(zinfo))
+            if rel['Type'].endswith("/image") and rel.get('TargetMode') != "External"
+        }
+        if not image_rels:
+            continue
+        if not part.endswith(".xml"):
+            _add_unknown_uses(uses, part, image_rels, image_rels)  # E.g. VML drawings, which we do not parse.
+            continue
+        root = ET.fromstring(zipfd.read(part))
+        parents = {child: parent for parent in root.iter() for child in parent}
+        blip_fills = [elem for elem in root.iter() if _local_name(elem.tag) == 'blipFill']
+        fill_blips = {_child(blip_fill, 'blip') for blip_fill in blip_fills}
+        # Pictures used other than by a blipFill, e.g. picture bullets (a:buBlip), or not found at all:
+        other_rids = {value for elem in root.iter() if elem not in fill_blips
+                      for key, value in elem.attrib.items() if key.startswith('{%s}' % NS['r'])}
+        other_rids |= set(image_rels) - {blip.get('{%s}embed' % NS['r']) for blip in fill_blips if blip is not None}
+        _add_unknown_uses(uses, part, image_rels, other_rids)
+        for index, blip_fill in enumerate(blip_fills):
+            blip = _child(blip_fill, 'blip')
+            rid = blip.get('{%s}embed' % NS['r']) if blip is not None else None
+            if rid not in image_rels:
+                continue
+            ancestors = []
+            elem = blip_fill
+            while elem in parents:
+                elem = parents[elem]
+                ancestors.append(elem)
+            size = None
+            if _child(blip_fill, 'tile') is not None:
+                pass  # Tiled fill, the picture is repeated at its own size.
+            elif any(_local_name(elem.tag) == 'bg' for elem in ancestors):
+                size = slide_size
+            else:
+                # The shape is the nearest ancestor with shape properties (p:spPr, pic:spPr, etc):
+                shape_idx = next((i for i, elem in enumerate(ancestors) if _child(elem, 'spPr') is not None), None)
+                if shape_idx is not None:
+                    size = _xfrm_ext(_child(ancestors[shape_idx], 'spPr'))
+                    # Shapes in groups are sized in the group's child coordinate space:
+                    for elem in ancestors[shape_idx+1:]:
+                        grp_sppr = _child(elem, 'grpSpPr')
+                        grp_xfrm = _child(grp_sppr, 'xfrm') if grp_sppr is not None else None
+                        if size is None or grp_xfrm is None:
+                            continue
+                        ext, ch_ext = _child(grp_xfrm, 'ext'), _child(grp_xfrm, 'chExt')
+                        if ext is not None and ch_ext is not None and int(ch_ext.get('cx')) and int(ch_ext.get('cy')):
+                            size = (size[0] * int(ext.get('cx')) / int(ch_ext.get('cx')),
+                                    size[1] * int(ext.get('cy')) / int(ch_ext.get('cy')))
+            uses.setdefault(image_rels[rid], []).append({
+                'part': part, 'rid': rid, 'index': index, 'size': size, 'src_rect': _src_rect(blip_fill),
+            })
+    return uses
+
+
+def get_render_sizes(picture_uses, dpi):
+    """Calculate how many pixels each picture needs, to be displayed at the given resolution.
+
+    Args:
+        picture_uses: dict with picture uses, as returned by `find_picture_uses`.
+        dpi: The target resolution, in pixels per inch (relative to the slide size).
+
+    Returns:
+        dict mapping media part name -> (width, height) in pixels, for the whole (uncropped) picture.
+        Pictures where the displayed size of one or more uses is unknown are not included.
+
+    """
+    render_sizes = {}
+    for media, uses in picture_uses.items():
+        if any(use['size'] is None for use in uses):
+            continue
+        width = height = 0
+        for use in uses:
+            left, top, right, bottom = use['src_rect']
+            # If the picture is cropped, the displayed part of the picture must have the required resolution:
+            width = max(width, use['size'][0] / EMU_PER_INCH * dpi / max(1 - left - right, 0.01))
+            height = max(height, use['size'][1] / EMU_PER_INCH * dpi / max(1 - top - bottom, 0.01))
+        render_sizes[media] = (int(round(width)), int(round(height)))
+    return render_sizes
+
+
+def get_crop_rects(picture_uses):
+    """Find the regions of each picture that are cropped out wherever the picture is used.
+
+    Args:
+        picture_uses: dict with picture uses, as returned by `find_picture_uses`.
+
+    Returns:
+        dict mapping media part name -> (left, top, right, bottom) fractions that can be cropped from the picture,
+        i.e. the union of the visible regions of all uses. Pictures that cannot be cropped are not included.
+
+    """
+    crop_rects = {}
+    for media, uses in picture_uses.items():
+        if any(use['size'] is None or min(use['src_rect']) < 0 for use in uses):
+            continue  # E.g. tiled fills, or pictures "cropped" outwards (padded).
+        crop_rect = tuple(min(values) for values in zip(*(use['src_rect'] for use in uses)))
+        if any(crop_rect):
+            crop_rects[media] = crop_rect
+    return crop_rects
+
+
+def crop_picture_uses(picture_uses, crop_rects):
+    """Return copy of picture uses, with crops (src_rect) relative to the pictures after cropping with crop_rects."""
+    cropped_uses = {}
+    for media, uses in picture_uses.items():
+        if media not in crop_rects:
+            cropped_uses[media] = uses
+            continue
+        left, top, right, bottom = crop_rects[media]
+        width, height = 1 - left - right, 1 - top - bottom
+        cropped_uses[media] = [dict(use, src_rect=(
+            (use['src_rect'][0] - left) / width, (use['src_rect'][1] - top) / height,
+            (use['src_rect'][2] - right) / width, (use['src_rect'][3] - bottom) / height,
+        )) for use in uses]
+    return cropped_uses
+
+
+def update_src_rects(xml, src_rects):
+    """Update the crop (srcRect) of blipFill elements in a part.
+
+    The xml is edited as text, to make sure that everything else in the part is kept exactly as-is.
+
+    Args:
+        xml: The part's xml (str).
+        src_rects: dict mapping blipFill index (in document order) -> new (left, top, right, bottom) crop fractions.
+            If all fractions are zero, the srcRect element is emptied.
+
+    Returns:
+        The updated xml (str).
+
+    """
+    index = -1
+
+    def update_blip_fill(match):
+        nonlocal index
+        index += 1
+        if index not in src_rects:
+            return match.group(0)
+        # srcRect values are given in 1/1000th of a percent:
+        attrs = "".join(' %s="%s"' % (side, int(round(value*100000)))
+                        for side, value in zip("ltrb", src_rects[index]) if round(value*100000))
+        return re.sub(r'<((?:\w+:)?srcRect)\b[^>]*?(?:/>|>.*?</\1>)',
+                      lambda m: '<%s%s/>' % (m.group(1), attrs), match.group(0), count=1, flags=re.DOTALL)
+
+    return re.sub(r'<((?:\w+:)?blipFill)\b[^>]*?(?:/>|>.*?</\1>)', update_blip_fill, xml, flags=re.DOTALL)
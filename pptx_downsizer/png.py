@@ -0,0 +1,193 @@
+"""
+
+Lossless PNG optimization for pptx-downsizer.
+
+PNG image data is compressed in two steps: Each row of pixels is first "filtered" (predicted from the
+neighbouring pixels), and the filtered rows are then deflate-compressed (zlib). Pillow chooses the filter
+for each row adaptively, and only exposes the zlib level. Here we try other filter strategies and zlib
+settings on the pixel data, and keep the smallest result, with more combinations tried at higher effort levels.
+
+"""
+
+import array
+import io
+import struct
+import zlib
+
+from PIL import Image, ImageChops
+
+try:
+    import zopfli.zlib
+except ImportError:
+    zopfli = None
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# PNG filter types:
+FILTER_NONE, FILTER_SUB, FILTER_UP, FILTER_AVERAGE = 0, 1, 2, 3
+
+# Image modes that PIL saves with 8 bits per sample, i.e. where we can filter the pixel data ourselves:
+FILTERABLE_MODES = ('L', 'LA', 'RGB', 'RGBA')
+
+# Filter strategies tried at each effort level (None = keep the filtering done by Pillow),
+# and the zlib (level, strategy) settings used to compress each of them:
+EFFORT_FILTERS = {
+    3: (None,),
+    4: (None, FILTER_NONE, FILTER_UP, 'minsum'),
+    5: (None, FILTER_NONE, FILTER_SUB, FILTER_UP, FILTER_AVERAGE, 'minsum'),
+    6: (None, FILTER_NONE, FILTER_SUB, FILTER_UP, FILTER_AVERAGE, 'minsum'),
+}
+EFFORT_ZLIB = {
+    3: ((9, zlib.Z_DEFAULT_STRATEGY), (9, zlib.Z_FILTERED)),
+    4: ((9, zlib.Z_DEFAULT_STRATEGY), (9, zlib.Z_FILTERED)),
+    5: ((9, zlib.Z_DEFAULT_STRATEGY), (9, zlib.Z_FILTERED), (9, zlib.Z_RLE)),
+    6: ((9, zlib.Z_DEFAULT_STRATEGY), (9, zlib.Z_FILTERED), (9, zlib.Z_RLE)),
+}
+
+# zlib level used by Pillow at effort levels 0-2 (level 2 also uses Pillow's `optimize`):
+PILLOW_COMPRESS_LEVELS = {0: 1, 1: 6, 2: 9}
+
+FILTER_NAMES = {FILTER_NONE: 'none', FILTER_SUB: 'sub', FILTER_UP: 'up', FILTER_AVERAGE: 'average'}
+ZLIB_STRATEGY_NAMES = {zlib.Z_DEFAULT_STRATEGY: 'default', zlib.Z_FILTERED: 'filtered', zlib.Z_RLE: 'rle'}
+
+# Maps each filtered byte to its magnitude as a signed byte, for the 'minsum' row filter heuristic:
+_SIGNED_MAGNITUDE = [min(value, 256 - value) for value in range(256)]
+
+
+def read_chunks(data):
+    """Return list of (chunk type, chunk data) for all chunks in PNG file data."""
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("Not a PNG file.")
+    chunks = []
+    pos = len(PNG_SIGNATURE)
+    while pos < len(data):
+        length, chunk_type = struct.unpack(">I4s", data[pos:pos+8])
+        chunks.append((chunk_type, data[pos+8:pos+8+length]))
+        pos += 12 + length  # length, type, data and crc.
+    return chunks
+
+
+def write_chunk(chunk_type, chunk_data):
+    """Return PNG chunk bytes, with length and crc."""
+    return (struct.pack(">I", len(chunk_data)) + chunk_type + chunk_data
+            + struct.pack(">I", zlib.crc32(chunk_type + chunk_data) & 0xffffffff))
+
+
+def filter_image(img, filter_type):
+    """Return the filtered pixel data of an 8-bit image (without the filter type bytes).
+
+    The filters are applied to whole images with `ImageChops`, i.e. in C, rather than row by row in Python.
+    Pixels outside the image are zero, as in the PNG specification.
+    """
+    if filter_type == FILTER_NONE:
+        return img.tobytes()
+    left = Image.new(img.mode, img.size)
+    left.paste(img.crop((0, 0, img.width - 1, img.height)), (1, 0))
+    up = Image.new(img.mode, img.size)
+    up.paste(img.crop((0, 0, img.width, img.height - 1)), (0, 1))
+    if filter_type == FILTER_SUB:
+        prediction = left
+    elif filter_type == FILTER_UP:
+        prediction = up
+    else:
+        prediction = ImageChops.add(left, up, scale=2)  # floor((left + up) / 2)
+    return ImageChops.subtract_modulo(img, prediction).tobytes()
+
+
+def filtered_scanlines(img, filter_strategy):
+    """Return the filtered scanlines of an 8-bit image, ready to be deflate-compressed into the IDAT chunk.
+
+    Args:
+        img: The `PIL.Image`, in one of the `FILTERABLE_MODES`.
+        filter_strategy: A PNG filter type used for all rows, or 'minsum' to use the filter (of none, sub,
+            up, and average) with the minimum sum of absolute values for each row, as recommended by the PNG spec.
+
+    """
+    stride = img.width * len(img.mode)
+    filter_types = (FILTER_NONE, FILTER_SUB, FILTER_UP, FILTER_AVERAGE) if filter_strategy == 'minsum' else (
+        filter_strategy,)
+    filtered = [filter_image(img, filter_type) for filter_type in filter_types]
+    if len(filtered) > 1:
+        row_costs = [row_magnitudes(data, stride, img.height) for data in filtered]
+        best_filters = [min(range(len(filtered)), key=costs.__getitem__) for costs in zip(*row_costs)]
+    else:
+        best_filters = [0] * img.height
+    rows = []
+    for row, best in enumerate(best_filters):
+        rows.append(bytes((filter_types[best],)))
+        rows.append(filtered[best][row*stride:(row+1)*stride])
+    return b"".join(rows)
+
+
+def row_magnitudes(data, stride, height):
+    """Return the mean absolute value (as signed bytes) of each row of filtered data, for the 'minsum' heuristic.
+
+    The rows are averaged by resizing the data (as an image) to a single column, i.e. in C, rather than in Python.
+    """
+    magnitudes = Image.frombytes('L', (stride, height), data).point(_SIGNED_MAGNITUDE).convert('F')
+    return array.array('f', magnitudes.resize((1, height), Image.BOX).tobytes())
+
+
+def encode_png(img, effort=2, messages=None):
+    """Encode image as PNG, using more time to make the file smaller at higher effort levels.
+
+    Effort levels:
+        0: Fast zlib compression, for quick previews.
+        1: Pillow's default compression.
+        2: Pillow's `optimize` (zlib level 9), like `encode_image(img, 'png', optimize=True)`.
+        3: Also try re-compressing Pillow's (adaptively filtered) data with other zlib strategies.
+        4: Also try other filter strategies (none, up, and choosing the filter for each row).
+        5: Try all filter strategies, and more zlib strategies.
+        6: As 5, but compress the best candidate using zopfli (if the `zopfli` package is installed).
+
+    Each level keeps the best result of the levels below it, so a higher level never gives a larger file,
+    but it takes (at least) as much time as all the levels below it.
+
+    Args:
+        img: The `PIL.Image` to encode.
+        effort: The effort level, 0-6.
+        messages: If given, append messages describing the result to this list.
+
+    Returns:
+        The PNG file data (bytes). The image data is lossless at all effort levels.
+
+    """
+    messages = [] if messages is None else messages
+    # Pillow skips filtering at its fastest zlib level, which can be smaller for noisy images,
+    # so each level keeps the smallest result of the levels below it.
+    data = None
+    for pillow_effort in range(min(effort, 2) + 1):
+        outfd = io.BytesIO()
+        img.save(outfd, format='PNG', optimize=pillow_effort >= 2,
+                 compress_level=PILLOW_COMPRESS_LEVELS[pillow_effort])
+        if data is None or len(outfd.getvalue()) < len(data):
+            data = outfd.getvalue()
+    if effort < 3:
+        return data
+    chunks = read_chunks(data)
+    idat_index = next(i for i, (chunk_type, _) in enumerate(chunks) if chunk_type == b"IDAT")
+    idat = b"".join(chunk_data for chunk_type, chunk_data in chunks if chunk_type == b"IDAT")
+    # Pillow only writes images in these modes with 8 bits per sample; e.g. palette images may use fewer bits.
+    filters = EFFORT_FILTERS[min(effort, 6)] if img.mode in FILTERABLE_MODES else (None,)
+    best_idat, best_desc, best_scanlines = idat, "pillow", None
+    for filter_strategy in filters:
+        scanlines = zlib.decompress(idat) if filter_strategy is None else filtered_scanlines(img, filter_strategy)
+        for level, strategy in EFFORT_ZLIB[min(effort, 6)]:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 15, 9, strategy)
+            candidate = compressor.compress(scanlines) + compressor.flush()
+            if len(candidate) < len(best_idat):
+                best_idat, best_scanlines = candidate, scanlines
+                best_desc = "%s filter, %s zlib strategy" % (
+                    FILTER_NAMES.get(filter_strategy, filter_strategy or "pillow"), ZLIB_STRATEGY_NAMES[strategy])
+    if effort >= 6 and zopfli is not None:
+        candidate = zopfli.zlib.compress(best_scanlines or zlib.decompress(idat))
+        if len(candidate) < len(best_idat):
+            best_idat, best_desc = candidate, best_desc + ", zopfli"
+    if best_idat is idat:
+        return data
+    messages.append(" - Optimized PNG from %s kb to %s kb (%s)" % (
+        len(data) // 1024, (len(data) - len(idat) + len(best_idat)) // 1024, best_desc))
+    chunks = [chunk for chunk in chunks if chunk[0] != b"IDAT"]
+    chunks.insert(idat_index, (b"IDAT", best_idat))
+    return PNG_SIGNATURE + b"".join(write_chunk(chunk_type, chunk_data) for chunk_type, chunk_data in chunks)
@@ -14,16 +14,41 @@ Currently only supports downsizing of images (not e.g. videos).
 # from __future__ import print_function
 import argparse
 import inspect
+import io
+import json
+import math
 import os
+import posixpath
+import shutil
+import sys
 import tempfile
+import time
 import zipfile
+from concurrent.futures import Future
 from fnmatch import fnmatch
 from functools import partial
-from glob import glob
 import yaml
 from PIL import Image
 
-from pptx_downsizer.utils import zip_directory, convert_str_to_int
+from pptx_downsizer.cache import ConversionCache
+from pptx_downsizer.ooxml import (
+    find_picture_uses, get_render_sizes, get_crop_rects, crop_picture_uses, update_src_rects,
+    index_relationships, update_rel_targets, source_part_name, update_content_types, find_unreachable_parts,
+    CONTENT_TYPES_PART)
+from pptx_downsizer.images import (
+    convert_image, estimate_image, probe_image, RESAMPLE_FILTERS, AUTO_FORMATS, FORMAT_EXTENSIONS, IMAGE_ERRORS)
+from pptx_downsizer.utils import (
+    zip_directory, convert_str_to_int, get_executor, copy_zip_member_raw, find_duplicate_members,
+    wait_for_result, DownsizeCancelled)
+
+# Presentations processed in memory are spilled to disk if they are larger than this:
+SPOOL_SIZE = 2**28
+
+# JPEG images are never converted to another format:
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+# Zip compression types that can be selected by name (e.g. on the command line):
+COMPRESS_TYPES = {name: getattr(zipfile, name) for name in ('ZIP_STORED', 'ZIP_DEFLATED', 'ZIP_BZIP2', 'ZIP_LZMA')}
 
 
 def downsize_pptx_images(
@@ -31,62 +56,149 @@ def downsize_pptx_images(
     # Image selection:
     fname_filter=None,  # Only filter files matching this filter (str or callable or None) - or maybe OR filter?
     fsize_filter=int(0.5*2**20),  # Only convert/reduce files above this filesize (number or None)
+    min_megapixels=None,  # Also convert/reduce images with more pixels than this (number or None)
+    min_bpp=None,  # Skip images that are already stored using less than this many bits per pixel.
     # Image conversion/save:
     convert_to="png",
     img_max_size=2048,
+    resample='lanczos',
+    target_dpi=None,
     quality=90,
+    quantize_colors=256,
+    auto_formats=('png', 'png8', 'jpeg'),
+    min_psnr=38.0,
+    target_image_size=None,
+    min_quality=30,
     optimize=True,
+    png_effort=None,
     img_mode=None,
     fill_color=None,  # e.g. '#ffffff',
+    target_pptx_size=None,
+    crop_images=False,
+    dedupe_media=False,
+    drop_orphans=False,
     # Output pptx file:
     outputfn_fmt="{fnroot}.downsized.pptx",  # "{filename}.downsized.pptx",
+    output=None,
     compress_type=zipfile.ZIP_DEFLATED,
+    recompress=False,
     wait_before_zip=False,
     overwrite=None,
     # Program behavior:
+    cache_dir=None,
+    cache_max_size=2**30,
+    jobs=None,
+    executor='process',
+    cancel_event=None,
     on_error='raise',
+    report=None,
+    return_report=False,
     verbose=2,
     # **writer_kwargs
 ):
     """Downsize a PowerPoint / OfficeOpen pptx file by compressing the images in the presentation.
 
     Args:
-        filename: Filename of the pptx input file.
+        filename: Filename of the pptx input file, or a seekable binary file object, e.g. `io.BytesIO`.
 
         fname_filter: Convert images matching this filename glob pattern, e.g. "*.TIFF".
         fsize_filter: Convert images with file size larger than this limit in bytes.
+        min_megapixels: Convert images with more than this many megapixels (in addition to images
+            larger than `fsize_filter` bytes or `img_max_size` pixels).
+        min_bpp: Skip images which are stored using fewer bits per pixel than this,
+            i.e. images that are already efficiently compressed, e.g. 1.0.
+        Images are selected based on their size and image header only, without decoding the images.
+        Animated images and images that cannot be read (e.g. vector images) are never converted.
 
         convert_to: Convert images to this image format - e.g. 'png' or 'jpeg'.
+            If 'auto', each image is encoded in all of the `auto_formats`, and the smallest is used.
         img_max_size: If an image is larger than this limit (width or height, in pixels),
             downscale/reduce the image to this size.
+        target_dpi: If given, downscale images to the size they are actually displayed at on the slides,
+            at this resolution (in pixels per inch), e.g. 150.
+            Images where the displayed size cannot be determined are only downscaled to `img_max_size`.
+        resample: Resampling filter used when downscaling images, e.g. 'lanczos' (best quality),
+            'bicubic', or 'box'. 'reduce' downscales images by an integer factor, which is the fastest.
         quality: Save images with this quality parameter (JPEG only).
+        quantize_colors: When converting to PNG, save low-color images (e.g. screenshots and diagrams)
+            as palette images with at most this many colors, if that preserves their appearance
+            (peak signal-to-noise ratio of at least `min_psnr`). 0 or None disables palette images.
+        auto_formats: The candidate formats used with `convert_to='auto'`: 'png', 'png8' (palette PNG),
+            'jpeg', and 'webp' (only supported by recent PowerPoint versions).
+        min_psnr: Only use lossy candidates (e.g. JPEG) with `convert_to='auto'`, and palette images,
+            if their peak signal-to-noise ratio relative to the original image is at least this, in dB.
+        target_image_size: If given, try to make all converted images smaller than this size (in bytes),
+            by reducing quality (JPEG only) down to `min_quality`, and then by downscaling the image.
+        min_quality: The lowest quality used when trying to reach `target_image_size`.
         optimize: Attempt to optimize the image output (for `PIL.Image.save`)
+        png_effort: If given, optimize PNG images with this effort level, from 0 (fastest) to 6 (smallest),
+            instead of `optimize`. Levels 3 and above try different PNG filters and zlib settings.
         img_mode: Convert images to this mode before saving - e.g. 'RGB'.
         fill_color: If converting images with alpha channels, use this color as background/fill color.
+        target_pptx_size: If given, try to make the output pptx file smaller than this size (in bytes).
+            The converted size of all images is estimated from a small sample of each image,
+            and the same quality (down to `min_quality`) and downscaling is then used for all images,
+            choosing the highest quality where the presentation fits within the size.
+            Images not selected by the filters above may also be converted, if needed to reach the size.
+        crop_images: If True, remove the parts of images that are cropped out on all slides where they are used.
+            The crop of each picture on the slides is updated accordingly.
+        dedupe_media: If True, remove duplicate media files, and make all slides use a single copy instead.
+            (Identical images are only converted once, regardless of this setting.)
+        drop_orphans: If True, remove parts that cannot be reached from the package relationships,
+            e.g. images that are no longer used on any slide, layout, master, or notes page.
+            This is done before selecting images, so orphaned images are never converted.
 
         outputfn_fmt: The filename format of the generated/downsized pptx file.
+        output: Write the downsized pptx to this filename or (seekable, writable) binary file object,
+            instead of a filename based on `outputfn_fmt`. Required if `filename` is a file object.
         wait_before_zip: If True, prompt the user to press enter before zipping the files in the temporary directory.
         compress_type: Use this zip compression method when making the pptx zip file.
+        recompress: If True, re-compress all files in the pptx zip file using `compress_type`.
+            By default, only changed files are compressed, and unchanged files are copied verbatim.
         overwrite: Whether to silently overwrite existing output file if it already exists.
 
+        cache_dir: Directory used to cache image conversion results across runs (None = no caching).
+            Images that have already been converted with the same parameters are not converted again.
+        cache_max_size: The maximum size of the cache, in bytes. Least recently used entries are evicted first.
+        jobs: Number of images to convert in parallel. Default (None) is to use one worker per CPU.
+        executor: How to run the image conversions, either 'process', 'thread', or 'serial'.
+            Can also be an existing `concurrent.futures.Executor`, e.g. to share a worker pool between calls.
+            The output is the same regardless of which executor is used.
+        cancel_event: Optional `threading.Event`. If the event is set (e.g. from another thread) while images are
+            being converted, the remaining image conversions are cancelled, and `DownsizeCancelled` is raised.
+            No output file is written.
+
         verbose: Verbosity level, i.e. how much information to print during execution.
         on_error: What to do if the program encounters any error.
             'continue' -> Print error message, then continue.
             'raise'    -> Abort executing and raise error message.
 
+        report: If given, write a JSON report of the run to this filename, see `return_report`. The filename can use
+            the same fields as `outputfn_fmt`, e.g. "{fnroot}.report.json", when downsizing several presentations
+            (only if `filename` is a filename, not a file object).
+        return_report: If True, return the report (dict) instead of the output filename. The report has the
+            `input` and `output` filenames and sizes (in bytes), one entry in `images` for each converted image
+            (with the original and new bytes, dimensions, and format, and the decode/resize/encode times),
+            the wall time of each stage in `stages` ('read', 'estimate', 'convert', 'rels', 'zip'),
+            and the summed per-image times in `image_times`. All times are in seconds.
+
     Returns:
-        Filename of the newly generated/downsized pptx file.
+        Filename of the newly generated/downsized pptx file (or the `output` file object), or the report.
 
     """
-    # TODO: If output is .jpg, you may need to add one of the following lines to presentation.xlm:
-    #       <Default Extension="jpeg" ContentType="image/jpeg"/>
-    #       <Default Extension="jpg" ContentType="application/octet-stream"/>
-
+    # Time at the end of each stage of the run, for the report:
+    stage_ends = [("start", time.perf_counter())]
     # OBS: File endings should be \r\n, even on Mac - because MS software.
-    assert os.path.isfile(filename)
-    old_fsize = os.path.getsize(filename)
-    pptx_fnroot, pptx_ext = os.path.splitext(filename)
-    print("\nDownsizing PowerPoint presentation %r (%0.01f MB)...\n" % (filename, old_fsize/2**20))
+    if isinstance(filename, str):
+        assert os.path.isfile(filename)
+        old_fsize = os.path.getsize(filename)
+        name = filename
+    else:
+        assert output is not None, "An `output` filename or file object is required when reading from a file object."
+        old_fsize = filename.seek(0, os.SEEK_END)
+        filename.seek(0)
+        name = stream_name(filename)
+    print("\nDownsizing PowerPoint presentation %r (%0.01f MB)...\n" % (name, old_fsize/2**20))
     convert_to = convert_to.lower().strip(".")
     if convert_to == "jpg":
         print("WARNING: Selected format 'jpg' should be 'jpeg' instead, switching...")
@@ -98,141 +210,521 @@ def downsize_pptx_images(
         filter_desc.append("above %0.01f kB" % (fsize_filter/2**10,))
     if img_max_size:
         filter_desc.append("larger than %s pixels" % img_max_size)
+    if min_megapixels:
+        filter_desc.append("larger than %s megapixels" % min_megapixels)
+    if target_dpi:
+        filter_desc.append("displayed at more than %s dpi" % target_dpi)
+    filter_desc = [" or ".join(filter_desc)]
     if fname_filter:
         filter_desc.append("with filename matching %r" % fname_filter)
+    if min_bpp:
+        filter_desc.append("using more than %s bits per pixel" % min_bpp)
 
-    print(" - Converting image files", " or ".join(filter_desc))
-    if isinstance(fname_filter, str):
-        fname_filter = partial(fnmatch, pat=fname_filter)
-
-    def ffilter(fname):
-        """Return True if file should be included."""
-        return (
-            (fsize_filter and os.path.getsize(fname) > fsize_filter)
-            and (fname_filter is None or fname_filter(fname))
-        )
-
+    print(" - Converting image files", ", ".join(filter_desc))
     output_ext = "." + convert_to.strip(".")
-    changed_fns = []
-    new_zip_fn = outputfn_fmt.format(filename=filename, fnroot=pptx_fnroot)
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        pptdir = os.path.join(tmpdirname, "ppt")
-        mediadir = os.path.join(pptdir, "media")
-        if verbose and verbose > 0:
-            print("\nExtracting %r to temporary directory %r..." % (filename, tmpdirname))
-        with zipfile.ZipFile(filename, 'r') as zipfd:
-            zipfd.extractall(tmpdirname)
-        if verbose and verbose > 1:
-            print("pptdir:", pptdir)
-            print("mediadir:", mediadir)
-        image_files = glob(os.path.join(mediadir, "image*"))
-        image_files = [fn for fn in image_files if ffilter(fn)]
-        print("\nConverting image files...")
-        for imgfn in image_files:
-            old_img_fsize = os.path.getsize(imgfn)
-            print("Converting %r (%s kb)..." % (imgfn,  old_img_fsize//1024))
-            fnbase, fnext = os.path.splitext(imgfn)
-            if fnext == '.jpg' or fnext == '.jpeg':
-                print(" - Preserving JPEG image format for file %r." % (imgfn,))
-                outputfn = imgfn
-            else:
-                outputfn = fnbase + output_ext
-            img = Image.open(imgfn)
-            if img_max_size and (img.height > img_max_size or img.width > img_max_size):
-                downscalefactor = (max(img.size) // img_max_size) + 1
-                newsize = tuple(v // downscalefactor for v in img.size)
-                if verbose and verbose > 1:
-                    print(" - Resizing %sx, from %s to %s" % (downscalefactor, img.size, newsize))
-                img.resize(newsize)
-            # extra/unused kwargs to Image.save are silently ignored (e.g. `quality` for png)
-            if img_mode:
+
+    if isinstance(auto_formats, str):
+        auto_formats = tuple(fmt.strip().lower() for fmt in auto_formats.split(","))
+    unknown_formats = set(auto_formats) - set(AUTO_FORMATS) if convert_to == 'auto' else ()
+    if unknown_formats:
+        raise ValueError("Unknown auto_formats %s, must be one of %s." % (
+            ", ".join(sorted(unknown_formats)), ", ".join(AUTO_FORMATS)))
+
+    def check_cancelled(futures=()):
+        """Raise DownsizeCancelled if `cancel_event` is set, after cancelling the given (pending) futures."""
+        if cancel_event is not None and cancel_event.is_set():
+            for future in futures:
+                future.cancel()
+            raise DownsizeCancelled()
+
+    def get_outputfn(imgfn, output_format=None):
+        """Return the output member name of a converted image. JPEG images are kept as JPEG.
+
+        With `convert_to='auto'`, the (PIL) `output_format` of the converted image determines the extension.
+        """
+        fnbase, fnext = posixpath.splitext(imgfn)
+        if fnext in JPEG_EXTENSIONS:
+            return imgfn
+        if convert_to == 'auto':
+            return fnbase + FORMAT_EXTENSIONS[output_format]
+        return fnbase + output_ext
+
+    def get_output_format(imgfn):
+        """Return the PIL format (or 'auto') to convert an image to."""
+        if convert_to == 'auto' and posixpath.splitext(imgfn)[1] not in JPEG_EXTENSIONS:
+            return 'auto'
+        return Image.registered_extensions()[posixpath.splitext(get_outputfn(imgfn, 'PNG'))[1].lower()]
+
+    image_reports = []  # Report entry for each converted image.
+    renamed_parts = {}  # Maps old member name -> new member name, for renamed (and removed duplicate) images.
+    # Maps archive member name -> (new member name, new data), for members that have changed.
+    # Members that should be removed from the output are mapped to (None, None).
+    new_entries = {}
+    if output is None:
+        pptx_fnroot, pptx_ext = os.path.splitext(filename)
+        output = outputfn_fmt.format(filename=filename, fnroot=pptx_fnroot)
+    new_zip_fn = output
+    output_name = new_zip_fn if isinstance(new_zip_fn, str) else stream_name(new_zip_fn)
+    with zipfile.ZipFile(filename, 'r') as zipfd:
+        # Everything is read directly from the input archive - no files are extracted to disk.
+        members = zipfd.infolist()
+        if drop_orphans:
+            orphans = find_unreachable_parts(zipfd, members)
+            print("Removing %s orphaned parts (%0.01f MB), not used anywhere in the presentation." % (
+                len(orphans), sum(zinfo.compress_size for zinfo in members if zinfo.filename in orphans)/2**20))
+            if verbose and verbose > 1:
+                print("\n".join(" - %s" % (fn,) for fn in sorted(orphans)))
+            members = [zinfo for zinfo in members if zinfo.filename not in orphans]
+        selection = select_images(
+            zipfd, members, fname_filter=fname_filter, fsize_filter=fsize_filter, img_max_size=img_max_size,
+            min_megapixels=min_megapixels, min_bpp=min_bpp, target_dpi=target_dpi, crop_images=crop_images,
+            dedupe_media=dedupe_media, verbose=verbose)
+        probes, duplicates = selection['probes'], selection['duplicates']
+        picture_uses, crop_rects, render_sizes = (
+            selection['picture_uses'], selection['crop_rects'], selection['render_sizes'])
+        image_members = selection['selected']
+        convert_kwargs = dict(
+            img_max_size=img_max_size, resample=resample, scale=1.0, quality=quality, optimize=optimize,
+            png_effort=png_effort,
+            target_image_size=target_image_size, min_quality=min_quality,
+            img_mode=img_mode, fill_color=fill_color)
+        quantize_kwargs = dict(quantize_colors=quantize_colors, min_psnr=min_psnr)
+        if convert_to == 'auto':
+            quantize_kwargs.update(auto_formats=auto_formats)
+        convert_kwargs.update(quantize_kwargs)
+        cache = ConversionCache(cache_dir, max_size=cache_max_size) if cache_dir else None
+        stage_ends.append(("read", time.perf_counter()))
+        with get_executor(executor, jobs=jobs) as pool:
+            if target_pptx_size:
+                # First pass: Estimate the converted size of all images that may be converted, at a range of qualities:
+                selected = {zinfo.filename for zinfo in image_members}
+                candidates = selection['convertible']
+                qualities = sorted(set(range(quality, min_quality, -5)) | {quality, min_quality}, reverse=True)
+                print("\nEstimating converted size of %s images at qualities %s..." % (
+                    len(candidates), ", ".join(map(str, qualities))))
+                estimate_futures = {}
+                for zinfo in candidates:
+                    check_cancelled(estimate_futures.values())
+                    origfn = duplicates.get(zinfo.filename, zinfo.filename)
+                    if origfn not in estimate_futures:
+                        estimate_futures[origfn] = pool.submit(
+                            estimate_image, zipfd.read(origfn), get_output_format(origfn), qualities,
+                            optimize=optimize, png_effort=png_effort, img_max_size=img_max_size, resample=resample,
+                            render_size=render_sizes.get(origfn), crop=crop_rects.get(origfn),
+                            img_mode=img_mode, fill_color=fill_color, **quantize_kwargs)
+                estimates = []  # List of (zinfo, estimate, current size or None if the image must be converted)
+                for zinfo in candidates:
+                    try:
+                        estimate = wait_for_result(
+                            estimate_futures[duplicates.get(zinfo.filename, zinfo.filename)], cancel_event)
+                    except DownsizeCancelled:
+                        check_cancelled(estimate_futures.values())
+                    except IMAGE_ERRORS as e:
+                        if on_error == "continue":
+                            print(" - ERROR reading image %r, skipping!" % (zinfo.filename,))
+                            image_reports.append({'name': zinfo.filename, 'error': "%s: %s" % (type(e).__name__, e)})
+                            image_members = [member for member in image_members if member is not zinfo]
+                            continue
+                        else:
+                            raise e
+                    estimates.append((zinfo, estimate, None if zinfo.filename in selected else zinfo.compress_size))
                 if verbose and verbose > 1:
-                    print(" - Changing image mode from %s to %s (fill color: %s)..." % (img_mode, img.mode, fill_color))
-                if fill_color:
-                    # From https://stackoverflow.com/questions/9166400/convert-rgba-png-to-rgb-with-pil
-                    img.load()  # needed for split()
-                    background = Image.new(img_mode, img.size, fill_color)
-                    background.paste(img, mask=img.split()[3])  # 3 is the alpha channel
-                    img = background
+                    for zinfo, estimate, current_size in estimates:
+                        print(" - %r (%s kb): %s" % (zinfo.filename, zinfo.file_size//1024, ", ".join(
+                            "q%s: %s kb" % (q, size//1024) for q, size in sorted(estimate['sizes'].items()))))
+                # Everything else is stored as-is; each member also has local and central directory headers:
+                estimated = {zinfo.filename for zinfo, estimate, current_size in estimates}
+                removed = set(duplicates) if dedupe_media else set()
+                fixed_size = 22 + sum(
+                    76 + 2*len(zinfo.filename) + (0 if zinfo.filename in estimated else zinfo.compress_size)
+                    for zinfo in members if zinfo.filename not in removed)
+                budget = target_pptx_size - fixed_size
+                if budget <= 0:
+                    print("\nWARNING: The presentation cannot be reduced to %0.01f MB by converting images, "
+                          "the other files alone take up %0.01f MB." % (target_pptx_size/2**20, fixed_size/2**20))
                 else:
-                    img = img.convert(img_mode)
-            try:
-                img.save(outputfn, optimize=optimize, quality=quality)
-            except OSError as e:
-                if on_error == "continue":
-                    print(" - ERROR saving image, skipping!")
+                    # Second pass: Convert all images with the highest quality that fits the budget:
+                    budget_quality, scale = allocate_size_budget(
+                        [(estimate['sizes'], current_size) for zinfo, estimate, current_size in estimates],
+                        budget, qualities)
+                    print(" - Size budget for images: %0.01f MB; using quality %s and %0.02fx downscaling." % (
+                        budget/2**20, budget_quality, 1/scale))
+                    convert_kwargs.update(quality=budget_quality, scale=scale)
+                    image_members = [zinfo for zinfo, estimate, current_size in estimates if current_size is None
+                                     or estimate['sizes'][budget_quality]*scale**2 < current_size]
+                stage_ends.append(("estimate", time.perf_counter()))
+            print("\nConverting image files...")
+            # Submit all images first, then collect the results in order, so the output is deterministic.
+            futures, cache_keys = [], []
+            submitted = {}  # Maps member name -> index in `futures`.
+            for zinfo in image_members:
+                check_cancelled(futures)  # The serial executor converts images as they are submitted.
+                if zinfo.filename in duplicates and duplicates[zinfo.filename] in submitted:
+                    # Re-use the conversion of the identical image:
+                    futures.append(futures[submitted[duplicates[zinfo.filename]]])
+                    cache_keys.append(None)
                     continue
+                submitted[zinfo.filename] = len(futures)
+                cache_keys.append(None)
+                output_format = get_output_format(zinfo.filename)
+                data = zipfd.read(zinfo)
+                image_kwargs = dict(convert_kwargs, render_size=render_sizes.get(zinfo.filename),
+                                    crop=crop_rects.get(zinfo.filename))
+                cached = None
+                if cache is not None:
+                    cache_keys[-1] = cache.make_key(data, output_format=output_format, **image_kwargs)
+                    cached = cache.get(cache_keys[-1])
+                if cached is not None:
+                    # Cache hit - no need to decode the image at all:
+                    future = Future()
+                    future.set_result(dict(cached, messages=[" - Using cached conversion result."], cached=True))
+                    futures.append(future)
                 else:
-                    raise e
-            print(" - Saved:  %r (%s kb)" % (outputfn, os.path.getsize(outputfn) // 1024))
-            new_img_fsize = os.path.getsize(outputfn)
-            if fsize_filter and new_img_fsize > fsize_filter and verbose and verbose > 0:
-                print(" - Notice: Filesize %s kb is still above the filesize limit (%s kb)"
-                      % (new_img_fsize//1024, fsize_filter//1024))
-            if fnext != output_ext:
-                # We only need to change the basename, all images are in the same directory...
-                changed_fns.append((os.path.basename(imgfn), os.path.basename(outputfn)))
-                os.remove(imgfn)
-                if verbose and verbose > 1:
-                    print(" - Deleted: %r" % (imgfn,))
+                    futures.append(pool.submit(convert_image, data, output_format, **image_kwargs))
+            for i, (zinfo, future) in enumerate(zip(image_members, futures)):
+                imgfn = zinfo.filename
+                print("Converting %r (%s kb)..." % (imgfn,  zinfo.file_size//1024))
+                if posixpath.splitext(imgfn)[1] in JPEG_EXTENSIONS:
+                    print(" - Preserving JPEG image format for file %r." % (imgfn,))
+                try:
+                    result = wait_for_result(future, cancel_event)
+                except DownsizeCancelled:
+                    check_cancelled(futures)  # Cancel the remaining conversions that have not started yet.
+                except IMAGE_ERRORS as e:
+                    if on_error == "continue":
+                        print(" - ERROR converting image, skipping!")
+                        image_reports.append({'name': imgfn, 'error': "%s: %s" % (type(e).__name__, e)})
+                        continue
+                    else:
+                        raise e
+                if imgfn not in submitted:
+                    print(" - Identical to %r, re-using converted image." % (duplicates[imgfn],))
+                for message in result['messages']:
+                    if verbose and verbose > 1:
+                        print(message)
+                outputfn = get_outputfn(imgfn, result['format'])
+                if cache is not None and imgfn in submitted and not result.get('cached'):
+                    cache.put(cache_keys[i], result)
+                new_entries[imgfn] = (outputfn, result['data'])
+                new_img_fsize = len(result['data'])
+                print(" - Converted:  %r (%s kb)" % (outputfn, new_img_fsize // 1024))
+                if fsize_filter and new_img_fsize > fsize_filter and verbose and verbose > 0:
+                    print(" - Notice: Filesize %s kb is still above the filesize limit (%s kb)"
+                          % (new_img_fsize//1024, fsize_filter//1024))
+                if outputfn != imgfn:
+                    renamed_parts[imgfn] = outputfn
+                probe = probes[imgfn]
+                timings = result.get('timings', {}) if imgfn in submitted and not result.get('cached') else {}
+                image_reports.append({
+                    'name': imgfn, 'output': outputfn,
+                    'bytes': zinfo.file_size, 'output_bytes': new_img_fsize,
+                    'size': [probe['width'], probe['height']], 'output_size': result.get('size'),
+                    'format': probe['format'], 'output_format': result['format'],
+                    'decode_time': timings.get('decode', 0.0), 'resize_time': timings.get('resize', 0.0),
+                    'encode_time': timings.get('encode', 0.0),
+                    'cached': bool(result.get('cached')),
+                    'duplicate_of': None if imgfn in submitted else duplicates[imgfn],
+                })
+        stage_ends.append(("convert", time.perf_counter()))
+        if crop_rects:
+            # Update the crop of all pictures where the cropped-out regions have been removed from the image:
+            cropped = {fn for fn in crop_rects if new_entries.get(duplicates.get(fn, fn) if dedupe_media else fn)}
+            parts = sorted({use['part'] for fn in cropped for use in picture_uses[fn]})
+            if verbose and verbose > 0:
+                print("\nUpdating picture crops of %s images in %s parts..." % (len(cropped), len(parts)))
+            for part in parts:
+                src_rects = {use['index']: use['src_rect'] for fn in cropped
+                             for use in picture_uses[fn] if use['part'] == part}
+                new_entries[part] = (part, update_src_rects(zipfd.read(part).decode('utf-8'), src_rects).encode('utf-8'))
+        if dedupe_media:
+            # Remove duplicates and point all relationships to the (possibly converted) first copy instead:
+            for dupfn, origfn in duplicates.items():
+                renamed_parts[dupfn] = new_entries.get(origfn, (origfn,))[0]
+                new_entries[dupfn] = (None, None)
         if verbose and verbose > 1:
             print("\nChanged image filenames:")
-            print("\n".join("  %s -> %s" % tup for tup in changed_fns))
-
-        if verbose and verbose > 1:
-            print("\nFinding changed .xml.rels files...")
-        xml_files = glob(os.path.join(pptdir, "**", "*.xml.rels"), recursive=True)
-        changed_xml_fns = []
-        for xmlfn in xml_files:
-            with open(xmlfn) as fd:
-                xml = fd.read()
-                if any(oldimgfn in xml for oldimgfn, newimgfn in changed_fns):
-                    # Make sure to use '\r\n' as file endings, because Microsoft:
-                    changed_xml_fns.append((xmlfn, xml.replace("\n", "\r\n")))
-
-        print("\nMaking changes to %s of %s xml relationship files..." % (len(changed_xml_fns), len(xml_files)))
-        # Be a bit more stringent about replacing filenames in the xml (in case we have e.g. externally-linked images)
-        pat_fmt = r'"../media/{}"'
-        for xmlfn, xml in changed_xml_fns:
-            count = 0
-            for oldimgfn, newimgfn in changed_fns:
-                oldimgpat, newimgpat = pat_fmt.format(oldimgfn), pat_fmt.format(newimgfn)
-                xml = xml.replace(oldimgpat, newimgpat)
-                count += 1
+            print("\n".join("  %s -> %s" % item for item in renamed_parts.items()))
+
+        # Find the relationships to the renamed images (parsing each relationships part once), and update them:
+        rel_index = index_relationships(zipfd, members) if renamed_parts else {}
+        changed_rels = sorted({relsfn for part in renamed_parts for relsfn in rel_index.get(part, ())})
+        print("\nMaking changes to %s of %s xml relationship files..." % (
+            len(changed_rels), sum(zinfo.filename.endswith(".rels") for zinfo in members)))
+        for relsfn in changed_rels:
+            xml = update_rel_targets(zipfd.read(relsfn).decode('utf-8'), source_part_name(relsfn), renamed_parts)
             if verbose and verbose > 1:
-                print(" - Performed %s substitutions in file %r" % (count, xmlfn))
-            with open(xmlfn, 'w') as fd:
-                fd.write(xml)
+                print(" - Updated relationships in %r" % (relsfn,))
+            # Make sure to use '\r\n' as file endings, because Microsoft:
+            new_entries[relsfn] = (relsfn, xml.replace("\r\n", "\n").replace("\n", "\r\n").encode('utf-8'))
+
+        if any(zinfo.filename == CONTENT_TYPES_PART for zinfo in members):
+            # Make sure all (converted) parts have a content type, e.g. a Default entry for new image extensions:
+            part_names = [new_entries.get(zinfo.filename, (zinfo.filename,))[0] for zinfo in members]
+            xml = zipfd.read(CONTENT_TYPES_PART).decode('utf-8')
+            new_xml = update_content_types(xml, [name for name in part_names if name is not None])
+            if new_xml != xml:
+                if verbose and verbose > 1:
+                    print("\nUpdating content types (%s)..." % (CONTENT_TYPES_PART,))
+                new_entries[CONTENT_TYPES_PART] = (CONTENT_TYPES_PART, new_xml.encode('utf-8'))
+
+        stage_ends.append(("rels", time.perf_counter()))
+        check_cancelled()
+        if isinstance(new_zip_fn, str) and os.path.exists(new_zip_fn) and not overwrite:
+            print(("\nNOTICE: Output file already exists. If you want to keep the old file,\n%r,\n"
+                   "please move/rename it before continuing. ") % (new_zip_fn,))
+            input("Press enter to continue... ")
+
+        def output_entries():
+            """Generate (input zipinfo, output member name, output data) for all members of the new pptx."""
+            for zinfo in members:
+                if zinfo.filename in new_entries:
+                    if new_entries[zinfo.filename][0] is not None:
+                        yield (zinfo,) + new_entries[zinfo.filename]
+                else:
+                    yield zinfo, zinfo.filename, zipfd.read(zinfo)
 
         if wait_before_zip:
-            print("""\n\nWAITING BEFORE ZIP:  (` --wait-before-zip ` argument was provided)
+            # Manual changes require the files on disk, so write the presentation to a temporary directory:
+            with tempfile.TemporaryDirectory() as tmpdirname:
+                for zinfo, arcname, data in output_entries():
+                    fpath = os.path.join(tmpdirname, *arcname.split("/"))
+                    os.makedirs(os.path.dirname(fpath), exist_ok=True)
+                    with open(fpath, 'wb') as fd:
+                        fd.write(data)
+                print("""\n\nWAITING BEFORE ZIP:  (` --wait-before-zip ` argument was provided)
 This gives you an opportunity to make manual changes before zipping the archive.
 You can find the unzipped files in the temporary directory:
     %s
 """ % tmpdirname)
-            input("Press enter to continue...")
-        if os.path.exists(new_zip_fn) and not overwrite:
-            print(("\nNOTICE: Output file already exists. If you want to keep the old file,\n%r,\n"
-                   "please move/rename it before continuing. ") % (new_zip_fn,))
-            input("Press enter to continue... ")
-        print("\nCreating new pptx zip archive: %r" % (new_zip_fn,))
-        zip_directory(tmpdirname, new_zip_fn, relative=True, compress_type=compress_type, verbose=verbose)
-        new_fsize = os.path.getsize(new_zip_fn)
-        print("\nDone! New file size: %0.01f MB (%0.01f %% of original size)"
-              % (new_fsize/2**20, 100*new_fsize/old_fsize))
-
-        if convert_to == "png" and verbose and verbose > 0:
-            print("""
+                input("Press enter to continue...")
+                print("\nCreating new pptx zip archive: %r" % (output_name,))
+                zip_directory(tmpdirname, new_zip_fn, relative=True, compress_type=compress_type, verbose=verbose)
+        else:
+            print("\nCreating new pptx zip archive: %r" % (output_name,))
+            with zipfile.ZipFile(new_zip_fn, mode="w") as outfd:
+                for zinfo in members:
+                    if zinfo.filename in new_entries or recompress:
+                        arcname, data = new_entries.get(zinfo.filename) or (zinfo.filename, zipfd.read(zinfo))
+                        if arcname is None:
+                            continue  # Member has been removed.
+                        if verbose and verbose > 2:
+                            print(" - adding %r" % (arcname,))
+                        outfd.writestr(zipfile.ZipInfo(arcname, date_time=zinfo.date_time), data,
+                                       compress_type=compress_type)
+                    else:
+                        # Unchanged members are copied as-is, without decompressing and re-compressing:
+                        if verbose and verbose > 2:
+                            print(" - copying %r" % (zinfo.filename,))
+                        copy_zip_member_raw(zipfd, zinfo, outfd)
+
+    stage_ends.append(("zip", time.perf_counter()))
+    new_fsize = os.path.getsize(new_zip_fn) if isinstance(new_zip_fn, str) else new_zip_fn.tell()
+    print("\nDone! New file size: %0.01f MB (%0.01f %% of original size)"
+          % (new_fsize/2**20, 100*new_fsize/old_fsize))
+    if target_pptx_size and new_fsize > target_pptx_size:
+        print("NOTICE: The new file is still larger than the target size (%0.01f MB). "
+              "Try again with a lower `--min-quality` or `--img-max-size`." % (target_pptx_size/2**20,))
+
+    if convert_to == "png" and verbose and verbose > 0:
+        print("""
 Notice: This pptx downsizing was done using PNG images (the default setting). 
 PNG format preserves the appearance and quality of images very well, 
 but may result in large file sizes for complex pictures with lots of fine details. 
 If you noticed that some files were still excessive in size (in the output above), 
-try running pptx-downsizer again with `--convert-to jpeg` as argument, e.g.: 
-    $ pptx-downsizer "{}" --convert-to jpeg""".format(new_zip_fn))
+try running pptx-downsizer again with `--convert-to auto` as argument, 
+which uses JPEG for images where that is smaller (and looks the same), e.g.: 
+    $ pptx-downsizer "{}" --convert-to auto""".format(name))
+
+    if report or return_report:
+        run_report = {
+            'input': name, 'input_bytes': old_fsize,
+            'output': output_name,
+            'output_bytes': new_fsize,
+            'quality': convert_kwargs['quality'], 'scale': convert_kwargs['scale'],
+            'images': image_reports,
+            'stages': {stage: t - prev for (_, prev), (stage, t) in zip(stage_ends, stage_ends[1:])},
+            'image_times': {step: sum(image.get(step + '_time', 0.0) for image in image_reports)
+                            for step in ('decode', 'resize', 'encode')},
+            'total_time': stage_ends[-1][1] - stage_ends[0][1],
+        }
+        if report:
+            if isinstance(filename, str):  # File objects may not have a name to format the report filename with.
+                report = report.format(filename=filename, fnroot=os.path.splitext(filename)[0])
+            with open(report, 'w') as fd:
+                json.dump(run_report, fd, indent=1)
+            print("Report written to %r." % (report,))
+        if return_report:
+            return run_report
 
     return new_zip_fn
 
 
+def stream_name(fileobj):
+    """Return the name of a file object for messages, or '<stream>' if it has no (file)name, e.g. `io.BytesIO`."""
+    name = getattr(fileobj, 'name', None)
+    return name if isinstance(name, str) else "<stream>"
+
+
+def select_images(
+        zipfd, members=None, fname_filter=None, fsize_filter=None, img_max_size=None, min_megapixels=None,
+        min_bpp=None, target_dpi=None, crop_images=False, dedupe_media=False, verbose=2):
+    """Select the images of a presentation to convert, and find how to crop and downscale them.
+
+    Only the image headers and the slides are read, the images are not decoded.
+    Used by both `downsize_pptx_images` and the dry-run analysis, so they select images the same way.
+    Identical images share their conversion, so they are cropped to the union of the regions used by all copies,
+    and downscaled to the largest size needed by any copy.
+
+    Args:
+        zipfd: The pptx `zipfile.ZipFile`.
+        members: The `ZipInfo` members to consider (default: all members).
+        fname_filter, fsize_filter, img_max_size, min_megapixels, min_bpp, target_dpi, crop_images, dedupe_media:
+            The image selection options, see `downsize_pptx_images`.
+        verbose: Verbosity level.
+
+    Returns:
+        dict with the image `probes` (see `probe_image`, None for members that are not images),
+        the `duplicates` (see `find_duplicate_members`), the `picture_uses` (see `find_picture_uses`),
+        the `crop_rects` and `render_sizes` of the images (by member name),
+        the `convertible` members (images that may be converted, e.g. to reach a target pptx size),
+        and the `selected` members (images that should be converted).
+        With `dedupe_media`, duplicates are neither convertible nor selected.
+
+    """
+    members = zipfd.infolist() if members is None else members
+    if isinstance(fname_filter, str):
+        fname_filter = partial(fnmatch, pat=fname_filter)
+
+    def convertible(zinfo, probe):
+        """Return True if zip archive member is an image that may be converted, based on the image header."""
+        if probe is None or probe['animated']:
+            return False  # Not an image that we can convert (or an animation, which we don't want to flatten).
+        if fname_filter is not None and not fname_filter(zinfo.filename):
+            return False
+        if min_bpp and probe['bpp'] <= min_bpp:
+            return False  # Image is already stored efficiently.
+        return True
+
+    def ffilter(zinfo, probe, render_size=None, crop_rect=None):
+        """Return True if zip archive member should be included, based on the member info and image header."""
+        if not convertible(zinfo, probe):
+            return False
+        return bool(
+            (fsize_filter and zinfo.file_size > fsize_filter)
+            or (img_max_size and max(probe['width'], probe['height']) > img_max_size)
+            or (min_megapixels and probe['width']*probe['height'] > min_megapixels*1e6)
+            # Image is displayed significantly smaller than its size (at the target resolution):
+            or (render_size and max(render_size[0]/probe['width'], render_size[1]/probe['height']) < 0.75)
+            or crop_rect  # Cropped-out regions can be removed.
+        )
+
+    # Read just the image headers, so we can select images without decoding them:
+    probes = {zinfo.filename: probe_image(zipfd, zinfo) for zinfo in members
+              if fnmatch(zinfo.filename, "ppt/media/*")}
+    # Find identical images, so each unique image is only converted once (and optionally only stored once):
+    duplicates = find_duplicate_members(zipfd, [zinfo for zinfo in members if probes.get(zinfo.filename)])
+    if duplicates and verbose and verbose > 0:
+        print("\nFound %s duplicate media files%s." % (
+            len(duplicates), ", which will be removed" if dedupe_media else ""))
+    dup_groups = [[origfn] + [dupfn for dupfn in duplicates if duplicates[dupfn] == origfn]
+                  for origfn in sorted(set(duplicates.values()))]
+    # Find how large each picture is displayed on the slides, and how it is cropped:
+    picture_uses = find_picture_uses(zipfd, members) if (target_dpi or crop_images) else {}
+    crop_rects = get_crop_rects(picture_uses) if crop_images else {}
+    for group in dup_groups:
+        # Identical images share their conversion, so they must be cropped the same way:
+        rects = [crop_rects.pop(fn, None) for fn in group]
+        if None not in rects:
+            crop_rects.update((fn, tuple(map(min, *rects))) for fn in group)
+    picture_uses = crop_picture_uses(picture_uses, crop_rects)
+    render_sizes = get_render_sizes(picture_uses, target_dpi) if target_dpi else {}
+    for group in dup_groups:
+        # ... and must be large enough for all uses:
+        sizes = [render_sizes.pop(fn, None) for fn in group]
+        if None not in sizes:
+            render_sizes.update((fn, tuple(map(max, *sizes))) for fn in group)
+    image_members = [zinfo for zinfo in members if zinfo.filename in probes and ffilter(
+        zinfo, probes[zinfo.filename], render_sizes.get(zinfo.filename), crop_rects.get(zinfo.filename))]
+    removed = set(duplicates) if dedupe_media else set()
+    return {
+        'probes': probes, 'duplicates': duplicates, 'picture_uses': picture_uses,
+        'crop_rects': crop_rects, 'render_sizes': render_sizes,
+        'convertible': [zinfo for zinfo in members if zinfo.filename in probes and zinfo.filename not in removed
+                        and convertible(zinfo, probes[zinfo.filename])],
+        'selected': [zinfo for zinfo in image_members if zinfo.filename not in removed],
+    }
+
+
+def downsize_pptx_bytes(data, spool_size=SPOOL_SIZE, return_fileobj=False, **kwargs):
+    """Downsize a pptx presentation in memory, without reading or writing any files.
+
+    Args:
+        data: The pptx file data, as bytes or a binary file object (e.g. an uploaded file).
+            Non-seekable file objects are first copied to a temporary file, which is kept in memory
+            unless it is larger than `spool_size`.
+        spool_size: The downsized presentation is kept in memory unless it is larger than this many bytes,
+            in which case it is spilled to a temporary file on disk.
+        return_fileobj: If True, return the downsized presentation as a file object (positioned at the start),
+            instead of bytes. This avoids reading very large presentations into memory.
+        **kwargs: Keyword arguments for `downsize_pptx_images`, e.g. `convert_to`.
+
+    Returns:
+        The downsized pptx file data (bytes), or a `tempfile.SpooledTemporaryFile` if `return_fileobj` is True.
+
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        infile = io.BytesIO(data)
+    elif data.seekable():
+        infile = data
+    else:
+        infile = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        shutil.copyfileobj(data, infile)
+        infile.seek(0)
+    outfile = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    try:
+        downsize_pptx_images(infile, output=outfile, **kwargs)
+    except BaseException:
+        outfile.close()
+        raise
+    outfile.seek(0)
+    if return_fileobj:
+        return outfile
+    with outfile:
+        return outfile.read()
+
+
+def allocate_size_budget(estimates, budget, qualities):
+    """Find the highest quality and scale, used for all images, where the images fit within a size budget.
+
+    Using the same quality and scale for all images spreads the loss of quality evenly over the presentation.
+
+    Args:
+        estimates: List of (sizes, current_size) tuples, one for each image, where `sizes` is a dict with the
+            estimated converted size at each quality, and `current_size` is the size of the unconverted image,
+            or None if the image is converted regardless. Images are only converted if that makes them smaller.
+        budget: The total size available for the images, in bytes.
+        qualities: The qualities to choose between.
+
+    Returns:
+        (quality, scale) tuple. If the images do not fit at the lowest quality, the scale is less than 1.0.
+
+    """
+    def total_size(quality, scale=1.0):
+        # The encoded size is roughly proportional to the number of pixels:
+        return sum(sizes[quality]*scale**2 if current_size is None else min(sizes[quality]*scale**2, current_size)
+                   for sizes, current_size in estimates)
+
+    qualities = sorted(qualities, reverse=True)
+    for quality in qualities:
+        if total_size(quality) <= budget:
+            return quality, 1.0
+    quality, scale = qualities[-1], 1.0
+    for _ in range(5):
+        # Unconverted images do not get smaller when downscaling, so refine the scale a few times:
+        scale *= min(1.0, 0.97*math.sqrt(budget/max(total_size(quality, scale), 1)))
+    return quality, scale
+
+
 # Consider using `click` package instead of argparse, since the CLI maps so directly to a single function.
 # See https://gist.github.com/scholer/fbfdaa1fb30ad296cb6b06b0446a2307 for a discussion of CLI packages.
 
@@ -249,46 +741,107 @@ def get_argparser(defaults=None):
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
     )
     # pptx input options:
-    ap.add_argument("filename", help="Path to the PowerPoint pptx file that you want to down-size.")
+    ap.add_argument("filename", nargs="+", help=(
+        "Path to the PowerPoint pptx file that you want to down-size. "
+        "Several files, directories (searched recursively for pptx files), and glob patterns may be given, "
+        "in which case the presentations are downsized using one shared pool of image conversion workers."))
     # image input selection:
     ap.add_argument("--fname-filter", metavar="GLOB", default=defaults['fname_filter'], help=(
         "Convert all images matching this filename pattern, e.g. '*.TIFF'"))
     ap.add_argument("--fsize-filter", metavar="SIZE", default=defaults['fsize_filter'], help=(
         "Convert all images with a current file size exceeding this limit, e.g. '1e6' for 1 MB."))
+    ap.add_argument("--min-megapixels", metavar="MEGAPIXELS", default=defaults['min_megapixels'], type=float, help=(
+        "Also convert all images with more than this many megapixels, e.g. '4' for 4 million pixels."))
+    ap.add_argument("--min-bpp", metavar="BITS", default=defaults['min_bpp'], type=float, help=(
+        "Skip images that are stored using fewer bits per pixel than this, e.g. '1.0'. "
+        "These images are already efficiently compressed, and will not benefit much from conversion."))
     # image convert/output/save options:
     ap.add_argument("--convert-to", metavar="IMAGE_FORMAT", default=defaults['convert_to'], help=(
-        "Convert images to this image format, e.g. `png` or `jpeg`."))
+        "Convert images to this image format, e.g. `png` or `jpeg`. "
+        "`auto` tries several formats (see `--auto-formats`) for each image, and uses the smallest."))
+    ap.add_argument("--auto-formats", metavar="FORMATS", default=",".join(defaults['auto_formats']), help=(
+        "Comma-separated list of the formats tried with `--convert-to auto`: "
+        "png, png8 (palette png), jpeg, and webp (requires PowerPoint 2019 or later)."))
+    ap.add_argument("--quantize-colors", metavar="N", default=defaults['quantize_colors'], type=int, help=(
+        "Save low-color png images (e.g. screenshots and diagrams) as palette images with at most this many "
+        "colors, if that preserves their appearance (see `--min-psnr`). Use 0 to disable."))
+    ap.add_argument("--min-psnr", metavar="DB", default=defaults['min_psnr'], type=float, help=(
+        "Only use palette images, and lossy formats with `--convert-to auto`, for images where the "
+        "peak signal-to-noise ratio is at least this, i.e. the images look practically the same."))
     ap.add_argument("--img-max-size", metavar="PIXELS", default=defaults['img_max_size'], type=int, help=(
         "If images are larger than this size (width or height), "
         "reduce/downscale the image size to make it less than this size."))
+    ap.add_argument("--resample", metavar="FILTER", default=defaults['resample'], choices=sorted(RESAMPLE_FILTERS),
+                    help=(
+        "Resampling filter used when downscaling large images, e.g. `lanczos` (best quality), `bicubic`, or `box`. "
+        "`reduce` downscales images by an integer factor (fastest)."))
+    ap.add_argument("--target-dpi", metavar="DPI", default=defaults['target_dpi'], type=float, help=(
+        "Downscale images to the size they are displayed at on the slides, at this resolution, e.g. 150. "
+        "The displayed size is read from the slides, layouts, and masters where the image is used."))
     ap.add_argument("--img-mode", metavar="MODE", default=defaults['img_mode'], help=(
         "Convert images to this image mode before saving them, e.g. 'RGB' - advanced option."))
     ap.add_argument("--fill-color", metavar="COLOR", default=defaults['fill_color'], help=(
         "If converting image mode (e.g. from RGBA to RGB), use this color for transparent regions."))
     ap.add_argument("--quality", metavar="[1-100]", default=defaults['quality'], type=int, help=(
         "Quality of converted images (only applies to jpeg output)."))
+    ap.add_argument("--target-image-size", metavar="SIZE", default=defaults['target_image_size'], help=(
+        "Try to make each converted image smaller than this size, e.g. '200kb', "
+        "first by reducing the quality (jpeg only), then by downscaling the image."))
+    ap.add_argument("--min-quality", metavar="[1-100]", default=defaults['min_quality'], type=int, help=(
+        "The lowest quality used when reducing quality to reach `--target-image-size` or `--target-pptx-size`."))
+    ap.add_argument("--target-pptx-size", metavar="SIZE", default=defaults['target_pptx_size'], help=(
+        "Try to make the downsized presentation smaller than this size, e.g. '10mb', "
+        "by using the highest image quality (jpeg only) and size where all images fit."))
     ap.add_argument("--optimize", default=defaults['optimize'], action="store_true", dest="optimize", help=(
         "Try to optimize the converted image output when saving. "
         "Optimizing the output may produce better images, "
         "but disabling it may make the conversion run faster. Enabled by default."))
     ap.add_argument("--no-optimize", default=not defaults['optimize'], action="store_false", dest="optimize", help=(
         "Disable optimization."))
+    ap.add_argument("--png-effort", metavar="[0-6]", default=defaults['png_effort'], type=int, choices=range(7),
+                    help=(
+        "How much effort to spend on making png images smaller (instead of `--optimize`), "
+        "from 0 (fastest, e.g. for previews) to 6 (smallest, tries many png filters and zlib settings). "
+        "Level 6 uses the `zopfli` package, if installed."))
+    ap.add_argument("--crop-images", default=defaults['crop_images'], action="store_true", help=(
+        "Remove cropped-out regions of images (the parts that are not visible on any of the slides)."))
+    ap.add_argument("--dedupe-media", default=defaults['dedupe_media'], action="store_true", help=(
+        "Remove duplicate media files (identical images), so that the presentation only contains one copy."))
+    ap.add_argument("--drop-orphans", default=defaults['drop_orphans'], action="store_true", help=(
+        "Remove orphaned files, e.g. images that are not used on any slide, layout, master, or notes page."))
     # pptx output options:
     ap.add_argument("--outputfn_fmt", metavar="FORMAT-STRING", default=defaults['outputfn_fmt'], help=(
         "How to format the downsized presentation pptx filename "
         "Slightly advanced, uses python string formatting."))
     ap.add_argument("--overwrite", default=defaults['overwrite'], action="store_true", help=(
         "Whether to silently overwrite existing file if the output filename already exists."))
-    ap.add_argument("--compress-type", metavar="ZIP-TYPE", default='ZIP_DEFLATED', help=(
+    ap.add_argument("--compress-type", metavar="ZIP-TYPE", default='ZIP_DEFLATED', choices=COMPRESS_TYPES, help=(
         "Which zip compression type to use, e.g. ZIP_DEFLATED, ZIP_BZIP2, or ZIP_LZMA."))
+    ap.add_argument("--recompress", default=defaults['recompress'], action="store_true", help=(
+        "Re-compress all files in the pptx zip archive using the `--compress-type` method. "
+        "By default, only changed files are compressed, and unchanged files are copied without re-compressing."))
     ap.add_argument("--wait-before-zip", default=defaults['wait_before_zip'], action="store_true", help=(
         "If this flag is specified, the program will wait after converting "
         "all images before re-zipping the output pptx file. "
         "You can use this to make manual changes to the presentation - advanced option."))
     # verbosity and other program/display behavior:
+    ap.add_argument("--cache-dir", metavar="DIRECTORY", default=defaults['cache_dir'], help=(
+        "Cache converted images in this directory, so the same images are not converted again in later runs."))
+    ap.add_argument("--cache-max-size", metavar="SIZE", default=defaults['cache_max_size'], help=(
+        "Maximum size of the image conversion cache, e.g. '1e9' for 1 GB."))
+    ap.add_argument("--jobs", metavar="N", default=defaults['jobs'], type=int, help=(
+        "Number of images to convert in parallel. Default is to use one worker per CPU."))
+    ap.add_argument("--executor", metavar="KIND", default=defaults['executor'],
+                    choices=('process', 'thread', 'serial'), help=(
+        "How to run image conversions in parallel: `process`, `thread`, or `serial`."))
+    ap.add_argument("--max-concurrent", metavar="N", default=4, type=int, help=(
+        "When downsizing several presentations, process at most this many presentations at the same time."))
     ap.add_argument("--on-error", metavar="DO-WHAT", default=defaults['on_error'], help=(
         "What to do if the program encounters any errors during execution. "
         "`continue` will cause the program to continue even if one or more images fails to be converted."))
+    ap.add_argument("--report", metavar="FILENAME", default=defaults['report'], help=(
+        "Write a JSON report with the size, format, dimensions and conversion times of each image, "
+        "and the time spent in each stage, e.g. 'report.json' (or '{fnroot}.report.json' for several files)."))
     ap.add_argument("--verbose", metavar="[0-5]", default=defaults['verbose'], type=int, help=(
         "Increase or decrease the 'verbosity' of the program, "
         "i.e. how much information it prints about the process."))
@@ -296,27 +849,53 @@ def get_argparser(defaults=None):
     return ap
 
 
-def parse_args(argv=None, defaults=None):
-    ap = get_argparser(defaults=defaults)
+def parse_args(argv=None, defaults=None, ap=None):
+    ap = get_argparser(defaults=defaults) if ap is None else ap
     argns = ap.parse_args(argv)
-    if argns.fsize_filter:
-        try:
-            argns.fsize_filter = convert_str_to_int(argns.fsize_filter)
-        except ValueError:
-            ap.print_usage()
-            print("Error: fsize_filter must be numeric, is %r" % argns.fsize_filter)
+    for key in ('fsize_filter', 'target_image_size', 'target_pptx_size', 'cache_max_size'):
+        value = getattr(argns, key)
+        if value and isinstance(value, str):
+            try:
+                setattr(argns, key, convert_str_to_int(value))
+            except ValueError:
+                ap.error("argument --%s: invalid size %r, must be a number or e.g. '500kb' or '10mb'" % (
+                    key.replace("_", "-"), value))
     if argns.compress_type and isinstance(argns.compress_type, str):
-        argns.compress_type = getattr(zipfile, argns.compress_type)
+        argns.compress_type = COMPRESS_TYPES[argns.compress_type]
     return argns
 
 
 def cli(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "serve":
+        from pptx_downsizer import server
+        return server.cli(argv[1:])
+    if argv and argv[0] == "analyze":
+        from pptx_downsizer import analyze
+        return analyze.cli(argv[1:])
+    if argv and argv[0] == "watch":
+        from pptx_downsizer import watch
+        return watch.cli(argv[1:])
     argns = parse_args(argv)
     params = vars(argns)
     if argns.verbose and argns.verbose > 2:
         print("parameters:")
         print(yaml.dump(params, default_flow_style=False))
-    downsize_pptx_images(**params)
+    paths, max_concurrent = params.pop('filename'), params.pop('max_concurrent')
+    if len(paths) == 1 and os.path.isfile(paths[0]):
+        downsize_pptx_images(paths[0], **params)
+        return
+    from pptx_downsizer import batch
+    if argns.wait_before_zip:
+        print("Error: `--wait-before-zip` cannot be used when downsizing several presentations.")
+        sys.exit(2)
+    filenames = batch.find_presentations(paths, outputfn_fmt=argns.outputfn_fmt)
+    if not filenames:
+        print("No pptx files found in %s." % ", ".join(map(repr, paths)))
+        sys.exit(1)
+    results = batch.downsize_pptx_files(filenames, max_concurrent=max_concurrent, **params)
+    if any(isinstance(result, Exception) for result in results.values()):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,245 @@
+"""
+
+Service mode for pptx-downsizer: A long-running process that downsizes presentations on request.
+
+Jobs are JSON objects with the `filename` of the presentation, and `downsize_pptx_images` keyword arguments
+as options (except those in `SERVICE_OPTIONS`, which e.g. choose where files are written), e.g.::
+
+    {"filename": "/uploads/Presentation.pptx", "convert_to": "jpeg", "target_pptx_size": "10mb"}
+
+The response is a JSON object with the `output` filename and its `size`, or an `error` message.
+If the job has `"return_data": true`, the response also contains the output file `data` (base64-encoded).
+Instead of a `filename`, jobs can also give the presentation `data` (base64-encoded); the presentation is
+then downsized in memory, and the response contains the `data` of the downsized presentation.
+
+Jobs can be sent either as HTTP POST requests (`Content-Type: application/json`, without an `Origin` header,
+i.e. not from web pages) to a server on localhost, or as lines of JSON over a UNIX socket
+(one response line per job line). All jobs share the same, already started, image conversion worker pool,
+so each job only pays for converting its images (no Python/PIL startup), and concurrent jobs share the workers.
+
+"""
+
+import argparse
+import base64
+import inspect
+import json
+import os
+import signal
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+from pptx_downsizer.pptx_downsizer import downsize_pptx_images, downsize_pptx_bytes, COMPRESS_TYPES
+from pptx_downsizer.utils import convert_str_to_int, get_executor
+
+
+# Options that are given by the service, not by the jobs (jobs must not choose where files are written):
+SERVICE_OPTIONS = (
+    'filename', 'output', 'outputfn_fmt', 'report', 'cache_dir', 'overwrite', 'verbose',
+    'executor', 'jobs', 'cancel_event', 'wait_before_zip', 'return_report')
+# Options where sizes may be given as strings, e.g. '10mb':
+SIZE_OPTIONS = ('fsize_filter', 'target_image_size', 'target_pptx_size', 'cache_max_size')
+# Options used for all jobs, since the service cannot prompt the user:
+JOB_OPTIONS = {'overwrite': True, 'verbose': 0}
+
+
+def warm_up_worker(_=None):
+    """Load all PIL image plugins, so the first jobs do not have to."""
+    Image.init()
+    return os.getpid()
+
+
+def run_job(job, executor):
+    """Run a single downsizing job.
+
+    Args:
+        job: dict with the `filename` (or base64-encoded `data`) of the presentation,
+            options for `downsize_pptx_images`, and optionally `return_data`,
+            to include the output file data in the result.
+        executor: The (shared) `concurrent.futures.Executor` used to convert images.
+
+    Returns:
+        dict with `ok` (True), the `output` filename, its `size`, and the `elapsed` time (in seconds),
+        and the output `data` (base64) if requested. For jobs with input `data`, there is no `output` filename.
+
+    Raises:
+        ValueError: If the job is invalid, e.g. has unknown options.
+
+    """
+    if not isinstance(job, dict) or not isinstance(job.get('filename', job.get('data')), str):
+        raise ValueError("Job must be a JSON object with a 'filename' or 'data'.")
+    options = dict(job)
+    filename = options.pop('filename', None)
+    data = options.pop('data', None)
+    return_data = options.pop('return_data', False)
+    known = set(inspect.signature(downsize_pptx_images).parameters) - set(SERVICE_OPTIONS)
+    unknown = set(options) - known
+    if unknown:
+        raise ValueError("Unknown job options: %s" % ", ".join(sorted(unknown)))
+    if filename is not None and not os.path.isfile(filename):
+        raise ValueError("File not found: %r" % (filename,))
+    for key in SIZE_OPTIONS:
+        if isinstance(options.get(key), str):
+            try:
+                options[key] = convert_str_to_int(options[key], do_eval=False)
+            except Exception:
+                raise ValueError("Invalid size for %s: %r" % (key, options[key]))
+    if 'compress_type' in options:
+        if not isinstance(options['compress_type'], str) or options['compress_type'] not in COMPRESS_TYPES:
+            raise ValueError("Invalid compress_type %r, must be one of %s." % (
+                options['compress_type'], ", ".join(COMPRESS_TYPES)))
+        options['compress_type'] = COMPRESS_TYPES[options['compress_type']]
+    options.update(JOB_OPTIONS)
+    start = time.perf_counter()
+    if data is not None:
+        data = downsize_pptx_bytes(base64.b64decode(data, validate=True), executor=executor, **options)
+        return {'ok': True, 'size': len(data), 'elapsed': round(time.perf_counter() - start, 3),
+                'data': base64.b64encode(data).decode('ascii')}
+    output = downsize_pptx_images(filename, executor=executor, **options)
+    result = {'ok': True, 'output': output, 'size': os.path.getsize(output),
+              'elapsed': round(time.perf_counter() - start, 3)}
+    if return_data:
+        with open(output, 'rb') as fd:
+            result['data'] = base64.b64encode(fd.read()).decode('ascii')
+    return result
+
+
+def handle_request(body, executor):
+    """Parse JSON job request, run the job, and return (status, response dict). Errors are returned, not raised."""
+    try:
+        return 200, run_job(json.loads(body), executor)
+    except ValueError as e:  # Including JSON decode errors.
+        return 400, {'ok': False, 'error': str(e)}
+    except Exception as e:
+        return 500, {'ok': False, 'error': "%s: %s" % (type(e).__name__, e)}
+
+
+def make_http_server(address, executor, verbose=1):
+    """Create a threading HTTP server on (host, port), running POSTed jobs with the given executor."""
+
+    class JobRequestHandler(BaseHTTPRequestHandler):
+
+        def _respond(self, status, response):
+            content = json.dumps(response).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self):
+            """Health check."""
+            self._respond(200, {'ok': True})
+
+        def do_POST(self):
+            # Browsers send an Origin header with cross-site requests, and cannot send JSON cross-site without it,
+            # so web pages cannot submit jobs to the service:
+            content_type = self.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            if self.headers.get("Origin") is not None:
+                self._respond(403, {'ok': False, 'error': "Cross-origin requests are not allowed."})
+                return
+            if content_type != "application/json":
+                self._respond(415, {'ok': False, 'error': "Jobs must be sent as application/json."})
+                return
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self._respond(*handle_request(body, executor))
+
+        def log_message(self, format, *args):
+            if verbose and verbose > 0:
+                super().log_message(format, *args)
+
+    return ThreadingHTTPServer(address, JobRequestHandler)
+
+
+def make_unix_server(path, executor, verbose=1):
+    """Create a threading UNIX socket server at `path`, running one job per line of JSON with the given executor."""
+
+    class JobStreamHandler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                status, response = handle_request(line, executor)
+                if verbose and verbose > 0:
+                    print("Job %s: %s" % ("done" if response['ok'] else "failed", response.get('output')
+                                         or response.get('error')))
+                self.wfile.write(json.dumps(response).encode('utf-8') + b"\n")
+                self.wfile.flush()
+
+    if os.path.exists(path):
+        os.remove(path)  # Stale socket from a previous run.
+    server = socketserver.ThreadingUnixStreamServer(path, JobStreamHandler)
+    server.daemon_threads = True
+    return server
+
+
+def _stop_service(signum, frame):
+    raise KeyboardInterrupt
+
+
+def serve(http=None, socket_path=None, jobs=None, executor='process', verbose=1):
+    """Run the downsizing service until interrupted (Ctrl+C or SIGTERM).
+
+    Args:
+        http: (host, port) to serve HTTP on, e.g. ('127.0.0.1', 8765).
+        socket_path: Path of a UNIX socket to serve on (instead of HTTP).
+        jobs: Number of image conversion workers, shared by all jobs (default: one per CPU).
+        executor: The kind of worker pool, 'process', 'thread', or 'serial'.
+        verbose: Verbosity level of the service itself. Jobs use their own `verbose` option (default 0).
+
+    """
+    with get_executor(executor, jobs=jobs) as pool:
+        # Start all workers now, rather than when the first job arrives:
+        list(pool.map(warm_up_worker, range(jobs or os.cpu_count() or 1)))
+        if socket_path:
+            server, where = make_unix_server(socket_path, pool, verbose=verbose), "UNIX socket %r" % socket_path
+        else:
+            server, where = make_http_server(http, pool, verbose=verbose), "http://%s:%s/" % http
+        if verbose and verbose > 0:
+            print("pptx-downsizer service listening on %s (press Ctrl+C to stop)..." % (where,))
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, _stop_service)  # E.g. when stopped by a service manager.
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            while thread.is_alive():
+                thread.join(1)
+        except KeyboardInterrupt:
+            print("\nStopping service...")
+        finally:
+            server.shutdown()
+            server.server_close()
+            if socket_path and os.path.exists(socket_path):
+                os.remove(socket_path)
+
+
+def get_argparser():
+    ap = argparse.ArgumentParser(
+        prog="pptx-downsizer serve",
+        description=(
+            "Run pptx-downsizer as a service, downsizing presentations sent as JSON jobs "
+            "over HTTP (on localhost) or a UNIX socket, using a shared pool of image conversion workers."),
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    ap.add_argument("--http", metavar="[HOST:]PORT", default="127.0.0.1:8765", help=(
+        "Serve HTTP on this address. Jobs are POSTed as JSON."))
+    ap.add_argument("--socket", metavar="PATH", dest="socket_path", help=(
+        "Serve on this UNIX socket instead of HTTP. Jobs are sent as lines of JSON."))
+    ap.add_argument("--jobs", metavar="N", type=int, help=(
+        "Number of images to convert in parallel, shared by all jobs. Default is to use one worker per CPU."))
+    ap.add_argument("--executor", metavar="KIND", default='process', choices=('process', 'thread', 'serial'), help=(
+        "How to run image conversions in parallel: `process`, `thread`, or `serial`."))
+    ap.add_argument("--verbose", metavar="[0-5]", default=1, type=int, help=(
+        "Verbosity of the service (each job has its own `verbose` option)."))
+    return ap
+
+
+def cli(argv=None):
+    argns = get_argparser().parse_args(argv)
+    host, _, port = argns.http.rpartition(":")
+    serve(http=(host or "127.0.0.1", int(port)), socket_path=argns.socket_path,
+          jobs=argns.jobs, executor=argns.executor, verbose=argns.verbose)
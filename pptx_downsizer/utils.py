@@ -1,6 +1,13 @@
+import copy
+import hashlib
 import os
+import re
+import struct
 import sys
 import zipfile
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import partial
 
 
 def zip_directory(directory, targetfn=None, relative=True, compress_type=zipfile.ZIP_DEFLATED, verbose=1):
@@ -37,42 +44,188 @@ def zip_directory(directory, targetfn=None, relative=True, compress_type=zipfile
     return targetfn
 
 
+# Private `zipfile.ZipFile` attributes used by `copy_zip_member_raw` on the input and output archives:
+ZIPFILE_READ_INTERNALS = ('_lock', 'fp')
+ZIPFILE_WRITE_INTERNALS = ('_lock', 'fp', '_writecheck', '_didModify', 'start_dir', 'filelist', 'NameToInfo')
+
+
+def copy_zip_member_raw(zipfd, zinfo, outfd):
+    """Copy a member from one zip archive to another, without decompressing and recompressing the data.
+
+    The compressed data (and CRC) is copied byte-for-byte from the input archive,
+    which is much faster than `outfd.writestr(zinfo, zipfd.read(zinfo))`.
+    This relies on `zipfile` internals (`ZipFile._lock`, `_writecheck`, etc.); members that cannot be copied
+    verbatim (encrypted or zip64 members, or if these internals are missing) are recompressed instead.
+
+    Args:
+        zipfd: The input `zipfile.ZipFile`, opened for reading.
+        zinfo: The `ZipInfo` of the member to copy.
+        outfd: The output `zipfile.ZipFile`, opened for writing.
+
+    Returns:
+        True if the member was copied verbatim, False if it had to be recompressed.
+
+    """
+    if (zinfo.flag_bits & 0x01 or max(zinfo.file_size, zinfo.compress_size, zinfo.header_offset)
+            >= zipfile.ZIP64_LIMIT or not all(hasattr(zipfd, attr) for attr in ZIPFILE_READ_INTERNALS)
+            or not all(hasattr(outfd, attr) for attr in ZIPFILE_WRITE_INTERNALS)):
+        # writestr sets the sizes, CRC and header offset on the ZipInfo, which still describes the input member:
+        outfd.writestr(copy.copy(zinfo), zipfd.read(zinfo))
+        return False
+    # Read the compressed data, located right after the member's local file header:
+    with zipfd._lock:
+        zipfd.fp.seek(zinfo.header_offset)
+        fheader = struct.unpack(zipfile.structFileHeader, zipfd.fp.read(zipfile.sizeFileHeader))
+        # Local header fields 10 and 11 are the lengths of the filename and extra fields:
+        zipfd.fp.seek(fheader[10] + fheader[11], os.SEEK_CUR)
+        data = zipfd.fp.read(zinfo.compress_size)
+    zinfo = copy.copy(zinfo)
+    # CRC and sizes are known up front, so we don't need a data descriptor after the data:
+    zinfo.flag_bits &= ~0x08
+    with outfd._lock:
+        outfd._writecheck(zinfo)
+        outfd._didModify = True
+        zinfo.header_offset = outfd.fp.tell()
+        outfd.fp.write(zinfo.FileHeader(zip64=False))
+        outfd.fp.write(data)
+        outfd.filelist.append(zinfo)
+        outfd.NameToInfo[zinfo.filename] = zinfo
+        outfd.start_dir = outfd.fp.tell()
+    return True
+
+
+def find_duplicate_members(zipfd, members):
+    """Find zip archive members with identical content.
+
+    Only members with the same CRC and size (as listed in the zip directory) are read and compared,
+    so for archives without duplicates, this does not read any data at all.
+
+    Args:
+        zipfd: The input `zipfile.ZipFile`, opened for reading.
+        members: The `ZipInfo` members to compare.
+
+    Returns:
+        dict mapping the name of each duplicate member to the name of the first identical member.
+
+    """
+    candidates = {}
+    for zinfo in members:
+        candidates.setdefault((zinfo.CRC, zinfo.file_size), []).append(zinfo)
+    duplicates = {}
+    for group in candidates.values():
+        if len(group) < 2:
+            continue
+        first_by_digest = {}
+        for zinfo in group:
+            hasher = hashlib.sha256()
+            with zipfd.open(zinfo) as fd:
+                for chunk in iter(partial(fd.read, 2**20), b""):
+                    hasher.update(chunk)
+            first = first_by_digest.setdefault(hasher.digest(), zinfo.filename)
+            if first != zinfo.filename:
+                duplicates[zinfo.filename] = first
+    return duplicates
+
+
+class SerialExecutor(Executor):
+    """Executor that runs every submitted call immediately, in the calling thread."""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+@contextmanager
+def get_executor(executor='process', jobs=None):
+    """Context manager providing an executor to distribute image conversion work.
+
+    Args:
+        executor: Either 'process', 'thread', or 'serial', or an existing `concurrent.futures.Executor` instance.
+            Existing executors are not shut down when the context exits, so they can be shared.
+        jobs: Number of workers to use. Default (None) is to use one worker per CPU.
+            Using a single job is the same as using the 'serial' executor.
+
+    Yields:
+        A `concurrent.futures.Executor` instance.
+
+    """
+    if isinstance(executor, Executor):
+        yield executor
+        return
+    with make_executor(executor, jobs=jobs) as pool:
+        yield pool
+
+
+def make_executor(executor='process', jobs=None):
+    """Create a new executor, see `get_executor`. The caller is responsible for shutting it down."""
+    if executor is None or executor == 'serial' or jobs == 1:
+        return SerialExecutor()
+    elif executor == 'thread':
+        return ThreadPoolExecutor(max_workers=jobs)
+    elif executor == 'process':
+        return ProcessPoolExecutor(max_workers=jobs)
+    raise ValueError("Unrecognized executor %r, must be one of 'process', 'thread', or 'serial'." % (executor,))
+
+
+class DownsizeCancelled(Exception):
+    """Raised when downsizing is cancelled, see the `cancel_event` argument of `downsize_pptx_images`."""
+
+
+def wait_for_result(future, cancel_event=None, poll_interval=0.1):
+    """Return the result of future, like `future.result()`, but raise `DownsizeCancelled` if cancel_event is set."""
+    if cancel_event is None:
+        return future.result()
+    while not cancel_event.is_set():
+        done, _ = wait([future], timeout=poll_interval)
+        if done:
+            return future.result()
+    raise DownsizeCancelled()
+
+
+# Size units, as multiples of bytes (like `humanfriendly.parse_size`, "kb" is 1000 bytes and "kib" is 1024 bytes):
+SIZE_UNITS = {'': 1, 'k': 1000, 'm': 1000**2, 'g': 1000**3, 't': 1000**4}
+
+
+def parse_size(s):
+    """Parse a human-readable size, e.g. '500kb', '1.5 MB', '2GiB', or '1e6', returning the number of bytes (int).
+
+    Raises:
+        ValueError: If the string is not a valid size.
+    """
+    match = re.fullmatch(r'\s*([0-9]*\.?[0-9]+(?:e[+-]?[0-9]+)?)\s*(?:([kmgt]?)(i?)b?)?\s*', str(s), flags=re.IGNORECASE)
+    if match is None:
+        raise ValueError("Invalid size: %r" % (s,))
+    number, prefix, binary = match.groups()
+    prefix = (prefix or '').lower()
+    unit = 1024**list(SIZE_UNITS).index(prefix) if binary else SIZE_UNITS[prefix]
+    return int(float(number) * unit)
+
+
 def convert_str_to_int(s, do_float=True, do_eval=True):
+    """Convert a string to int, e.g. '1000', '1e6', '500kb' (see `parse_size`), or (if `do_eval`) '2**20'.
+
+    Raises:
+        ValueError: If the string cannot be converted.
+    """
     try:
         return int(s)
-    except ValueError as e:
-        if do_float:
-            try:
-                return convert_str_to_int(float(s), do_float=False, do_eval=False)
-            except ValueError as e:
-                try:
-                    import humanfriendly
-                except ImportError:
-                    print((
-                        "Warning, the `humanfriendly` package is not available."
-                        "If you want to use e.g. \"500kb\" as filesize, "
-                        "please install the `humanfriendly` package:\n"
-                        "    pip install humanfriendly\n"))
-                    pass
-                    humanfriendly = None
-                else:
-                    try:
-                        return humanfriendly.parse_size(s)
-                    except humanfriendly.InvalidSize:
-                        pass
-
-                if do_eval:
-                    try:
-                        return convert_str_to_int(eval(s), do_float=do_float, do_eval=False)
-                    except (ValueError, SyntaxError) as e:
-                        print("Error, could not parse/convert string %r as integer. " % (s,))
-                        raise e
-                else:
-                    print("Error, could not parse/convert string %r as integer. " % (s,))
-                    raise e
-        else:
-            print("Error, could not parse/convert string %r as integer. " % (s,))
-            raise e
+    except ValueError:
+        pass
+    if do_float:
+        try:
+            return parse_size(s)
+        except ValueError:
+            pass
+    if do_eval:
+        try:
+            return int(eval(s, {'__builtins__': {}}))
+        except Exception:
+            pass
+    raise ValueError("Could not parse/convert string %r as integer." % (s,))
 
 
 def open_pptx(fpath):
@@ -0,0 +1,214 @@
+"""
+
+Watch mode for pptx-downsizer: Downsize presentations as they are added to (or changed in) a folder.
+
+The folder is re-scanned periodically; on Linux, if the `inotify_simple` package is installed, it is re-scanned
+as soon as files change instead. Presentations are only downsized once they have not changed for a while
+(i.e. once they have been completely written), using a persistent image conversion worker pool.
+
+Processed presentations are recorded in a JSON state index (by size and modification time),
+so presentations that have not changed are not downsized again, also after restarting.
+
+"""
+
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+from pptx_downsizer.batch import (
+    MAX_CONCURRENT, DEFAULT_OUTPUTFN_FMT, ThreadOutput, downsize_captured, find_presentations)
+from pptx_downsizer.pptx_downsizer import get_argparser as get_downsize_argparser, parse_args
+from pptx_downsizer.server import warm_up_worker
+from pptx_downsizer.utils import get_executor
+
+
+STATE_FILENAME = ".pptx-downsizer-state.json"
+
+# How long to wait for file changes, when nothing is pending (inotify only):
+IDLE_TIMEOUT = 60.0
+
+
+def file_signature(filename):
+    """Return [size, mtime in ns] of a file (a list, so it compares equal after a JSON round-trip), or None."""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None  # E.g. deleted since the directory was scanned.
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_state(state_file):
+    """Load the state index, mapping absolute filename -> dict with 'signature' and 'output' or 'error'."""
+    try:
+        with open(state_file) as fd:
+            return json.load(fd)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(state, state_file):
+    """Save the state index, replacing the file atomically so it is never left half-written."""
+    with open(state_file + ".tmp", 'w') as fd:
+        json.dump(state, fd, indent=1, sort_keys=True)
+    os.replace(state_file + ".tmp", state_file)
+
+
+class ChangeNotifier:
+    """Wait for changes to directory trees, using inotify if available, otherwise just sleeping."""
+
+    def __init__(self):
+        self.inotify = inotify_simple.INotify() if inotify_simple is not None else None
+        self.watched = set()
+
+    def update(self, directories):
+        """Watch all (new) subdirectories of the given directories."""
+        if self.inotify is None:
+            return
+        flags = inotify_simple.flags
+        mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.MODIFY | flags.DELETE
+        for directory in directories:
+            for dirpath, dirnames, fnames in os.walk(directory):
+                if dirpath not in self.watched:
+                    try:
+                        self.inotify.add_watch(dirpath, mask)
+                    except OSError:
+                        continue  # Removed meanwhile, or too many watches; the folder is still scanned.
+                    self.watched.add(dirpath)
+
+    def wait(self, timeout):
+        """Wait until files change (inotify), or for `timeout` seconds."""
+        if self.inotify is None:
+            time.sleep(timeout)
+        else:
+            self.inotify.read(timeout=int(timeout*1000))
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+
+
+def _stop_watching(signum, frame):
+    raise KeyboardInterrupt
+
+
+def watch(
+        directories, interval=2.0, settle_time=5.0, state_file=None, max_concurrent=MAX_CONCURRENT,
+        jobs=None, executor='process', outputfn_fmt=DEFAULT_OUTPUTFN_FMT, verbose=2, **kwargs):
+    """Watch directories, downsizing new and changed presentations, until interrupted (Ctrl+C or SIGTERM).
+
+    Args:
+        directories: The directories to watch (recursively) for pptx files.
+        interval: How often to scan the directories, in seconds. With inotify, the directories are scanned
+            when files change, and at this interval only while presentations are waiting or being processed.
+        settle_time: Presentations are downsized when their size and modification time have not changed
+            for this many seconds, i.e. when they are (probably) no longer being written.
+        state_file: Filename of the JSON state index (default: `.pptx-downsizer-state.json` in the first directory).
+        max_concurrent: The maximum number of presentations processed at the same time.
+        jobs: Number of image conversion workers, shared by all presentations (default: one per CPU).
+        executor: The kind of worker pool, 'process', 'thread', or 'serial'.
+        outputfn_fmt: The filename format of the downsized presentations (which are not downsized again).
+        verbose: Verbosity level.
+        **kwargs: Other keyword arguments for `downsize_pptx_images`.
+
+    """
+    state_file = state_file or os.path.join(directories[0], STATE_FILENAME)
+    state = load_state(state_file)
+    pending = {}  # Maps filename -> (signature, time when the file was first seen with this signature).
+    running = {}  # Maps future -> (filename, signature).
+    notifier = ChangeNotifier()
+    stdout = sys.stdout
+    sys.stdout = output = ThreadOutput(stdout)
+    decks = ThreadPoolExecutor(max_workers=max_concurrent)
+    try:
+        with get_executor(executor, jobs=jobs) as pool:
+            # Start all workers now (before the signal handler is set, so the workers do not inherit it):
+            list(pool.map(warm_up_worker, range(jobs or os.cpu_count() or 1)))
+            print("Watching %s for presentations (%s), press Ctrl+C to stop..." % (
+                ", ".join(map(repr, directories)), "inotify" if notifier.inotify else "polling"))
+            if threading.current_thread() is threading.main_thread():
+                signal.signal(signal.SIGTERM, _stop_watching)  # E.g. when stopped by a service manager.
+            try:
+                while True:
+                    notifier.update(directories)
+                    now = time.monotonic()
+                    busy = {filename for filename, signature in running.values()}
+                    outputs = {entry['output'] for entry in state.values() if entry.get('output')}
+                    for filename in find_presentations(directories, outputfn_fmt=outputfn_fmt):
+                        key = os.path.abspath(filename)
+                        signature = file_signature(filename)
+                        if signature is None or filename in busy or key in outputs:
+                            continue
+                        if key in state and state[key]['signature'] == signature:
+                            pending.pop(filename, None)  # Already processed.
+                        elif filename not in pending or pending[filename][0] != signature:
+                            pending[filename] = (signature, now)  # New or changed - wait for it to settle.
+                        elif now - pending[filename][1] >= settle_time:
+                            del pending[filename]
+                            if verbose and verbose > 0:
+                                print("Downsizing %r..." % (filename,))
+                            future = decks.submit(downsize_captured, output, filename, executor=pool,
+                                                  outputfn_fmt=outputfn_fmt, verbose=verbose, **kwargs)
+                            running[future] = (filename, signature)
+                    for future in [future for future in running if future.done()]:
+                        filename, signature = running.pop(future)
+                        result, text = future.result()
+                        if verbose and verbose > 1:
+                            stdout.write(text)
+                        if isinstance(result, Exception):
+                            print("ERROR downsizing %r: %s: %s" % (filename, type(result).__name__, result))
+                            entry = {'signature': signature, 'error': "%s: %s" % (type(result).__name__, result)}
+                        else:
+                            if verbose and verbose > 0:
+                                print("Downsized %r -> %r (%0.01f MB)" % (
+                                    filename, result, os.path.getsize(result)/2**20))
+                            entry = {'signature': signature, 'output': os.path.abspath(result)}
+                        state[os.path.abspath(filename)] = entry
+                        save_state(state, state_file)
+                    notifier.wait(interval if (pending or running or notifier.inotify is None) else IDLE_TIMEOUT)
+            except KeyboardInterrupt:
+                print("\nStopping, waiting for %s presentations being downsized..." % (len(running),))
+                decks.shutdown(cancel_futures=True)
+    finally:
+        decks.shutdown()
+        notifier.close()
+        sys.stdout = stdout
+
+
+def get_argparser():
+    ap = get_downsize_argparser()
+    ap.prog = "pptx-downsizer watch"
+    ap.description = (
+        "Watch directories, and downsize presentations (pptx files) when they are added or changed. "
+        "All options for downsizing presentations can be used.")
+    ap.add_argument("--interval", metavar="SECONDS", default=2.0, type=float, help=(
+        "How often to scan the directories for new or changed presentations."))
+    ap.add_argument("--settle-time", metavar="SECONDS", default=5.0, type=float, help=(
+        "Only downsize presentations that have not changed for this long, i.e. that are completely written."))
+    ap.add_argument("--state-file", metavar="FILENAME", help=(
+        "JSON file recording which presentations have been downsized "
+        "(default: %s in the first directory)." % STATE_FILENAME))
+    return ap
+
+
+def cli(argv=None):
+    argns = parse_args(argv, ap=get_argparser())
+    params = vars(argns)
+    directories = params.pop('filename')
+    for directory in directories:
+        if not os.path.isdir(directory):
+            print("Error: %r is not a directory." % (directory,))
+            sys.exit(2)
+    if params.pop('wait_before_zip'):
+        print("Error: `--wait-before-zip` cannot be used in watch mode.")
+        sys.exit(2)
+    params.pop('overwrite')  # Changed presentations are always downsized again.
+    watch(directories, **params)
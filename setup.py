@@ -152,12 +152,18 @@ setup(
             'pptx-downsizer=pptx_downsizer.pptx_downsizer:cli',
         ],
     },
+    python_requires='>=3.9',  # For `Executor.shutdown(cancel_futures=True)`.
     # install_requires: Minimal requirement for this project.
     # (Whereas `requirements.txt` is typically used to produce a comprehensive python environment.)
     install_requires=[
         'pyyaml',
-        'pillow',
+        'pillow>=7',  # For `Image.reduce` and `reducing_gap`.
     ],
+    # Optional features, e.g. ``pip install pptx-downsizer[watch,zopfli]``:
+    extras_require={
+        'watch': ['inotify_simple'],  # Detect new files immediately in watch mode (Linux only).
+        'zopfli': ['zopfli'],  # Smaller PNG files with `--png-effort 6`.
+    },
     classifiers=[
         # https://pypi.python.org/pypi?%3Aaction=list_classifiers
         # How mature is this project? Common values are
@@ -186,10 +192,11 @@ setup(
         # that you indicate whether you support Python 2, Python 3 or both.
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
 
         'Environment :: Console',
 
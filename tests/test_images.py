@@ -0,0 +1,36 @@
+"""Tests for the image conversion functions."""
+
+import io
+
+from PIL import Image
+
+from pptx_downsizer.images import convert_image, reduce_image
+
+
+def make_png(mode, size):
+    img = Image.linear_gradient('L').resize(size)
+    if mode == 'I;16':
+        img = img.convert('I').point(lambda v: v * 256).convert('I;16')
+    else:
+        img = img.convert(mode)
+    outfd = io.BytesIO()
+    img.save(outfd, 'PNG')
+    return outfd.getvalue()
+
+
+def test_reduce_16bit_grayscale():
+    # Image.reduce does not support I;16 images, which must be resized instead:
+    data = make_png('I;16', (1024, 512))
+    for resample in ('lanczos', 'reduce', 'nearest'):
+        img = reduce_image(Image.open(io.BytesIO(data)), (512, 256), resample)
+        assert img.size == (512, 256)
+    result = convert_image(data, 'png', img_max_size=512)
+    assert result['size'] == [512, 256]
+    assert Image.open(io.BytesIO(result['data'])).size == (512, 256)
+
+
+def test_reduce_palette_image_is_filtered():
+    img = Image.open(io.BytesIO(make_png('P', (600, 600))))
+    assert reduce_image(img, (100, 100), 'lanczos').mode == 'RGB'
+    img = Image.open(io.BytesIO(make_png('P', (600, 600))))
+    assert reduce_image(img, (100, 100), 'nearest').mode == 'P'
@@ -0,0 +1,112 @@
+"""End-to-end tests of `downsize_pptx_images` on a small synthetic presentation, built in memory."""
+
+import io
+import re
+import zipfile
+
+from PIL import Image
+
+from pptx_downsizer.pptx_downsizer import downsize_pptx_images
+
+REL_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/"
+CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">\
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>\
+<Default Extension="xml" ContentType="application/xml"/>\
+<Default Extension="tiff" ContentType="image/tiff"/><Default Extension="png" ContentType="image/png"/>\
+<Override PartName="/ppt/presentation.xml" \
+ContentType="application/vnd.openxmlformats-officedocument.presentationml.presentation.main+xml"/>\
+<Override PartName="/ppt/slides/slide1.xml" \
+ContentType="application/vnd.openxmlformats-officedocument.presentationml.slide+xml"/></Types>"""
+NAMESPACES = ('xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+              'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" '
+              'xmlns:p="http://schemas.openxmlformats.org/presentationml/2006/main"')
+PRESENTATION = ('<p:presentation %s><p:sldIdLst><p:sldId id="256" r:id="rId1"/></p:sldIdLst>'
+                '<p:sldSz cx="9144000" cy="6858000"/></p:presentation>' % NAMESPACES)
+PICTURE = ('<p:pic><p:nvPicPr><p:cNvPr id="{id}" name="Picture {id}"/><p:cNvPicPr/><p:nvPr/></p:nvPicPr>'
+           '<p:blipFill><a:blip r:embed="{rid}"/>{src_rect}<a:stretch><a:fillRect/></a:stretch></p:blipFill>'
+           '<p:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="1828800" cy="914400"/></a:xfrm></p:spPr></p:pic>')
+SLIDE = '<p:sld %s><p:cSld><p:spTree><p:nvGrpSpPr/><p:grpSpPr/>%s</p:spTree></p:cSld></p:sld>' % (NAMESPACES, "".join([
+    PICTURE.format(id=2, rid="rId1", src_rect="<a:srcRect/>"),
+    PICTURE.format(id=3, rid="rId2", src_rect="<a:srcRect/>"),
+    PICTURE.format(id=4, rid="rId3", src_rect='<a:srcRect l="50000"/>'),  # Left half cropped out.
+]))
+
+
+def relationships(*targets):
+    return ('<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">%s</Relationships>'
+            % "".join('<Relationship Id="rId%s" Type="%s%s" Target="%s"/>' % (i, REL_TYPE, rel_type, target)
+                      for i, (rel_type, target) in enumerate(targets, 1)))
+
+
+def encode(fmt, size=(200, 100)):
+    outfd = io.BytesIO()
+    Image.linear_gradient('L').resize(size).convert('RGB').save(outfd, fmt)
+    return outfd.getvalue()
+
+
+def make_pptx():
+    """Return a presentation with one slide, using a TIFF image twice (as two identical files) and a cropped PNG."""
+    tiff = encode('TIFF')
+    members = {
+        "[Content_Types].xml": CONTENT_TYPES,
+        "_rels/.rels": relationships(("officeDocument", "ppt/presentation.xml")),
+        "ppt/presentation.xml": PRESENTATION,
+        "ppt/_rels/presentation.xml.rels": relationships(("slide", "slides/slide1.xml")),
+        "ppt/slides/slide1.xml": SLIDE,
+        "ppt/slides/_rels/slide1.xml.rels": relationships(
+            ("image", "../media/image1.tiff"), ("image", "../media/image2.tiff"), ("image", "../media/image3.png")),
+        "ppt/media/image1.tiff": tiff,
+        "ppt/media/image2.tiff": tiff,
+        "ppt/media/image3.png": encode('PNG'),
+    }
+    infd = io.BytesIO()
+    # Stored (uncompressed) members, which would be deflated if they were recompressed rather than copied:
+    with zipfile.ZipFile(infd, 'w', zipfile.ZIP_STORED) as zipfd:
+        for name, data in members.items():
+            zipfd.writestr(name, data)
+    return infd
+
+
+def downsize(infd, **kwargs):
+    outfd = io.BytesIO()
+    downsize_pptx_images(infd, output=outfd, fsize_filter=1, executor='serial', verbose=0, **kwargs)
+    return zipfile.ZipFile(outfd)
+
+
+def test_unchanged_members_are_copied_verbatim():
+    infd = make_pptx()
+    with zipfile.ZipFile(infd) as zipfd, downsize(infd) as outzip:
+        for name in ("_rels/.rels", "ppt/presentation.xml", "ppt/slides/slide1.xml"):
+            zinfo, out_zinfo = zipfd.getinfo(name), outzip.getinfo(name)
+            assert (out_zinfo.CRC, out_zinfo.compress_size, out_zinfo.compress_type) == (
+                zinfo.CRC, zinfo.compress_size, zinfo.compress_type)
+        assert outzip.testzip() is None
+
+
+def test_converted_images_update_rels_and_content_types():
+    with downsize(make_pptx()) as outzip:
+        assert sorted(name for name in outzip.namelist() if name.startswith("ppt/media/")) == [
+            "ppt/media/image1.png", "ppt/media/image2.png", "ppt/media/image3.png"]
+        rels = outzip.read("ppt/slides/_rels/slide1.xml.rels").decode()
+        assert re.findall(r'Target="([^"]*)"', rels) == [
+            "../media/image1.png", "../media/image2.png", "../media/image3.png"]
+        content_types = outzip.read("[Content_Types].xml").decode()
+        assert 'Extension="png"' in content_types and 'Extension="tiff"' not in content_types
+        assert Image.open(io.BytesIO(outzip.read("ppt/media/image1.png"))).size == (200, 100)
+
+
+def test_dedupe_media():
+    with downsize(make_pptx(), dedupe_media=True) as outzip:
+        assert "ppt/media/image2.tiff" not in outzip.namelist()
+        assert "ppt/media/image2.png" not in outzip.namelist()
+        rels = outzip.read("ppt/slides/_rels/slide1.xml.rels").decode()
+        assert re.findall(r'Target="([^"]*)"', rels) == [
+            "../media/image1.png", "../media/image1.png", "../media/image3.png"]
+
+
+def test_crop_images():
+    with downsize(make_pptx(), crop_images=True) as outzip:
+        assert Image.open(io.BytesIO(outzip.read("ppt/media/image3.png"))).size == (100, 100)
+        slide = outzip.read("ppt/slides/slide1.xml").decode()
+        assert 'l="50000"' not in slide and slide.count("<a:srcRect/>") == 3
@@ -0,0 +1,54 @@
+"""Tests for the utility functions."""
+
+import copy
+import io
+import zipfile
+
+import pytest
+
+from pptx_downsizer import utils
+from pptx_downsizer.utils import convert_str_to_int, copy_zip_member_raw, parse_size
+
+
+def test_parse_size():
+    assert parse_size("1e6") == 1000000
+    assert parse_size("300kb") == 300000
+    assert parse_size("10 MB") == 10000000
+    assert parse_size("0.5MiB") == 2**19
+    with pytest.raises(ValueError):
+        parse_size("10zz")
+
+
+def test_convert_str_to_int_without_eval():
+    assert convert_str_to_int("2**20") == 2**20
+    with pytest.raises(ValueError):
+        convert_str_to_int("2**20", do_eval=False)
+    with pytest.raises(ValueError):
+        convert_str_to_int("10 parrots")
+
+
+def make_zip(members):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zipfd:
+        for name, data in members.items():
+            zipfd.writestr(name, data)
+    return buf
+
+
+@pytest.mark.parametrize('internals', [utils.ZIPFILE_WRITE_INTERNALS, ('_missing_attribute',)])
+def test_copy_zip_member_raw(monkeypatch, internals):
+    expect_raw = internals == utils.ZIPFILE_WRITE_INTERNALS
+    monkeypatch.setattr(utils, 'ZIPFILE_WRITE_INTERNALS', internals)
+    members = {'a.xml': b"<a/>" * 100, 'b.bin': bytes(range(256)) * 10}
+    outbuf = io.BytesIO()
+    with zipfile.ZipFile(make_zip(members)) as zipfd, zipfile.ZipFile(outbuf, 'w') as outfd:
+        for zinfo in zipfd.infolist():
+            original = copy.copy(zinfo)
+            copied = copy_zip_member_raw(zipfd, zinfo, outfd)
+            assert copied == expect_raw
+            # The input archive's ZipInfo must be left untouched, also when recompressing:
+            assert (zinfo.header_offset, zinfo.CRC, zinfo.compress_size) == (
+                original.header_offset, original.CRC, original.compress_size)
+    with zipfile.ZipFile(outbuf) as outfd:
+        assert outfd.testzip() is None
+        assert {name: outfd.read(name) for name in outfd.namelist()} == members